@@ -193,7 +193,7 @@ class AlpacaBroker(with_metaclass(MetaAlpacaBroker, BrokerBase)):
 
     def _reject(self, oref):
         order = self.orders[oref]
-        logger.warning(f"Rejecting order {oref}: {order.__class__.__name__} - Size: {order.size}, Price: {order.price}, Exectype: {order.exectype}")
+        logger.warning("Rejecting order %s: %s - Size: %s, Price: %s, Exectype: %s", oref, order.__class__.__name__, order.size, order.price, order.exectype)
         order.reject(self)
         self.notify(order)
         self._bracketize(order, cancel=True)
@@ -208,14 +208,14 @@ class AlpacaBroker(with_metaclass(MetaAlpacaBroker, BrokerBase)):
 
     def _cancel(self, oref):
         order = self.orders[oref]
-        logger.warning(f"Cancelling order {oref}: {order.__class__.__name__} - Size: {order.size}, Price: {order.price}, Exectype: {order.exectype}")
+        logger.warning("Cancelling order %s: %s - Size: %s, Price: %s, Exectype: %s", oref, order.__class__.__name__, order.size, order.price, order.exectype)
         order.cancel()
         self.notify(order)
         self._bracketize(order, cancel=True)
 
     def _expire(self, oref):
         order = self.orders[oref]
-        logger.warning(f"Expiring order {oref}: {order.__class__.__name__} - Size: {order.size}, Price: {order.price}, Exectype: {order.exectype}")
+        logger.warning("Expiring order %s: %s - Size: %s, Price: %s, Exectype: %s", oref, order.__class__.__name__, order.size, order.price, order.exectype)
         order.expire()
         self.notify(order)
         self._bracketize(order, cancel=True)
@@ -233,7 +233,7 @@ class AlpacaBroker(with_metaclass(MetaAlpacaBroker, BrokerBase)):
 
         if not cancel:
             if len(br) == 3:  # all 3 orders in place, parent was filled
-                logger.debug(f"Parent order {pref} filled, activating bracket orders")
+                logger.debug("Parent order %s filled, activating bracket orders", pref)
                 br = br[1:]  # discard index 0, parent
                 for o in br:
                     o.activate()  # simulate activate for children
@@ -241,18 +241,18 @@ class AlpacaBroker(with_metaclass(MetaAlpacaBroker, BrokerBase)):
 
             elif len(br) == 2:  # filling a children
                 oidx = br.index(order)  # find index to filled (0 or 1)
-                logger.debug(f"Child order {order.ref} filled, cancelling remaining bracket order")
+                logger.debug("Child order %s filled, cancelling remaining bracket order", order.ref)
                 self._cancel(br[1 - oidx].ref)  # cancel remaining (1 - 0 -> 1)
         else:
             # Any cancellation cancel the others
-            logger.debug(f"Cancelling all bracket orders for parent {pref}")
+            logger.debug("Cancelling all bracket orders for parent %s", pref)
             for o in br:
                 if o.alive():
                     self._cancel(o.ref)
 
     def _fill(self, oref, size, price, ttype, **kwargs):
         order = self.orders[oref]
-        logger.debug(f"Filling order {oref}: {order.__class__.__name__} - Size: {size}, Price: {price}, Type: {ttype}")
+        logger.debug("Filling order %s: %s - Size: %s, Price: %s, Type: %s", oref, order.__class__.__name__, size, price, ttype)
         data = order.data
         pos = self.getposition(data, clone=False)
         psize, pprice, opened, closed = pos.update(size, price)
@@ -268,11 +268,11 @@ class AlpacaBroker(with_metaclass(MetaAlpacaBroker, BrokerBase)):
                       psize, pprice)
 
         if order.executed.remsize:
-            logger.debug(f"Partial fill for order {oref}: {order.executed.remsize} remaining")
+            logger.debug("Partial fill for order %s: %s remaining", oref, order.executed.remsize)
             order.partial()
             self.notify(order)
         else:
-            logger.debug(f"Complete fill for order {oref}")
+            logger.debug("Complete fill for order %s", oref)
             order.completed()
             self.notify(order)
             self._bracketize(order)
@@ -286,7 +286,7 @@ class AlpacaBroker(with_metaclass(MetaAlpacaBroker, BrokerBase)):
                 # to order creation. Return the takeside order, to have 3s
                 takeside = order  # alias for clarity
                 parent, stopside = self.opending.pop(pref)
-                logger.info(f"Creating bracket orders - Parent: {parent.ref}, Stop: {stopside.ref}, Take: {takeside.ref}")
+                logger.info("Creating bracket orders - Parent: %s, Stop: %s, Take: %s", parent.ref, stopside.ref, takeside.ref)
                 for o in parent, stopside, takeside:
                     self.orders[o.ref] = o  # write them down
 
@@ -299,7 +299,7 @@ class AlpacaBroker(with_metaclass(MetaAlpacaBroker, BrokerBase)):
                 return self.o.order_create(order)
 
         # Not transmitting
-        logger.debug(f"Order {oref} not being transmitted yet")
+        logger.debug("Order %s not being transmitted yet", oref)
         self.opending[pref].append(order)
         return order
 
@@ -1,7 +1,9 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
-from datetime import timedelta
+from datetime import datetime, timedelta
+import random
+from operator import attrgetter
 import pandas as pd
 from backtrader.feed import DataBase
 from backtrader import date2num, num2date
@@ -94,7 +96,34 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
 
       - ``reconntimeout`` (default: ``5.0``)
 
-        Time in seconds to wait in between reconnection attemps
+        Not used anymore. Kept for compatibility, the wait in between
+        reconnection attempts is controlled by the ``reconn_backoff_*`` params
+
+      - ``reconn_backoff_min`` (default: ``0.5``)
+
+        Time in seconds to wait before the first reconnection attempt. The
+        wait is doubled after each failed attempt
+
+      - ``reconn_backoff_max`` (default: ``30.0``)
+
+        Maximum time in seconds to wait in between reconnection attempts
+
+      - ``reconn_jitter`` (default: ``0.1``)
+
+        Maximum random time in seconds added to each wait, to avoid feeds
+        reconnecting in lockstep
+
+      - ``max_backlog`` (default: ``64``)
+
+        Number of pending live messages above which the feed catches up: ticks
+        older than the newest one are dropped and bars are folded into a
+        single bar stamped with the newest time
+
+      - ``live_latest_only`` (default: ``False``)
+
+        Keep only the newest live record instead of queueing all of them. A
+        consumer falling behind then always gets the latest bar/tick and never
+        a stale one. Meant for pure live mode (no backfilling)
 
     This data feed supports only this mapping of ``timeframe`` and
     ``compression``, which comply with the definitions in the Alpaca API
@@ -136,16 +165,29 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
         ('reconnect', True),
         ('reconnections', -1),  # forever
         ('reconntimeout', 5.0),
+        ('reconn_backoff_min', 0.5),
+        ('reconn_backoff_max', 30.0),
+        ('reconn_jitter', 0.1),
         ('data_feed', DataFeed.IEX),  # options iex/sip for pro
+        ('max_backlog', 64),  # live queue depth which triggers a catch-up
+        ('live_latest_only', False),  # single slot live queue
     )
 
     _store = alpacastore.AlpacaStore
 
     # States for the Finite State Machine in _load
     _ST_FROM, _ST_START, _ST_LIVE, _ST_HISTORBACK, _ST_OVER = range(5)
+    _CONTINUE = object()  # handler result: dispatch again on the new state
 
     _TOFFSET = timedelta()
 
+    # request (599), streaming (598) and network (596) errors: reconnect
+    _RECOVERABLE_CODES = frozenset((599, 598, 596))
+
+    # live messages carry ns since the epoch: convert with plain arithmetic
+    _NS_PER_DAY = 86400 * 10 ** 9
+    _BT_EPOCH = date2num(datetime(1970, 1, 1))
+
     def _timeoffset(self):
         # Effective way to overcome the non-notification?
         return self._TOFFSET
@@ -186,8 +228,25 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
         # Create attributes as soon as possible
         self._statelivereconn = False  # if reconnecting in live state
         self._storedmsg = dict()  # keep pending live message (under None)
-        self.qlive = queue.Queue()
+        self._histbars = None  # iterator over a preloaded history block
+        self._reconn_delay = self.p.reconn_backoff_min
+        self._last_ts_ns = -1  # last accepted timestamp (ns since epoch)
+        self.qlive = alpacastore.NotifiableDeque()
         self._state = self._ST_OVER
+        self._state_handlers = {
+            self._ST_FROM: self._handle_from,
+            self._ST_START: self._handle_start,
+            self._ST_LIVE: self._handle_live,
+            self._ST_HISTORBACK: self._handle_hist,
+            self._ST_OVER: self._handle_over,
+        }
+
+        # resolve the live message loader once instead of once per message
+        if self.p.timeframe == bt.TimeFrame.Ticks:
+            self._load_live = self._load_tick
+        else:
+            # might want to act differently for Days in the future
+            self._load_live = self._load_agg
 
         # Kickstart store and get queue to wait on
         self.o.start(data=self)
@@ -209,6 +268,11 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
             self._state = self._ST_FROM
             self.p.backfill_from.setenvironment(self._env)
             self.p.backfill_from._start()
+            # resolve the source/destination lines once for the copy
+            self._backfill_pairs = [
+                (getattr(self.p.backfill_from.lines, alias),
+                 getattr(self.lines, alias))
+                for alias in self.lines.getlinealiases()]
         else:
             self._start_finish()
             self._state = self._ST_START  # initial state for _load
@@ -232,7 +296,9 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
                 self.p.dataname, dtbegin, dtend,
                 self._timeframe, self._compression,
                 candleFormat=self._candleFormat,
-                includeFirst=self.p.includeFirst)
+                includeFirst=self.p.includeFirst,
+                dataframe=True,
+                defer=True)  # sent along the other datas' on first load
 
             self._state = self._ST_HISTORBACK
             return True
@@ -242,7 +308,8 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
         self.qlive = self.o.streaming_prices(self.p.dataname,
                                              self.p.timeframe,
                                              tmout=tmout,
-                                             data_feed=self.p.data_feed)
+                                             data_feed=self.p.data_feed,
+                                             latest_only=self.p.live_latest_only)
         
         # Handle backfill settings for live data
         if instart:
@@ -281,141 +348,200 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
         return bool(self._storedmsg or self.qlive)  # do not return the objs
 
     def _load(self):
-        if self._state == self._ST_OVER:
-            logger.debug("Data feed in OVER state")
+        # Each handler either returns the result of the load or _CONTINUE to
+        # re-dispatch on the (possibly updated) state
+        handlers = self._state_handlers
+        while True:
+            ret = handlers[self._state]()
+            if ret is not self._CONTINUE:
+                return ret
+
+    def _handle_over(self):
+        logger.debug("Data feed in OVER state")
+        return False
+
+    def _handle_live(self):
+        try:
+            msg = (self._storedmsg.pop(None, None) or
+                   self.qlive.get(timeout=self._qcheck))
+        except queue.Empty:
+            return None  # indicate timeout situation
+
+        if msg is None:  # Conn broken during historical/backfilling
+            logger.warning("Connection broken during historical/backfilling")
+            self.put_notification(self.CONNBROKEN)
+            # Try to reconnect
+            if not self.p.reconnect or self._reconns == 0:
+                logger.error("Cannot reconnect - no more attempts left")
+                self.put_notification(self.DISCONNECTED)
+                self._state = self._ST_OVER
+                return False  # failed
+
+            self._reconns -= 1
+            logger.debug("Attempting reconnection, attempts left: %d",
+                         self._reconns)
+            self._st_start(instart=False, tmout=self._reconn_tmout())
+            return self._CONTINUE
+
+        if isinstance(msg, dict):  # records are tuples, errors dicts
+            code = msg.get('code')
+            logger.warning("Received error code in message: %s", code)
+            self.put_notification(self.CONNBROKEN)
+            if code not in self._RECOVERABLE_CODES:
+                logger.error("Unrecoverable error code: %s", code)
+                self.put_notification(self.DISCONNECTED)
+                self._state = self._ST_OVER
+                return False  # failed
+
+            if not self.p.reconnect or self._reconns == 0:
+                logger.error("Cannot reconnect - no more attempts left")
+                self.put_notification(self.DISCONNECTED)
+                self._state = self._ST_OVER
+                return False  # failed
+
+            # Can reconnect
+            self._reconns -= 1
+            logger.debug("Attempting reconnection after error, "
+                         "attempts left: %d", self._reconns)
+            self._st_start(instart=False, tmout=self._reconn_tmout())
+            return self._CONTINUE
+
+        self._reconns = self.p.reconnections
+        self._reconn_delay = self.p.reconn_backoff_min
+
+        if len(self.qlive) > self.p.max_backlog:
+            msg = self._drain_backlog(msg)
+
+        # Process the message according to expected return type
+        if not self._statelivereconn:
+            LIVE = self.LIVE
+            if self._laststatus != LIVE:
+                if len(self.qlive) <= 1:  # very short live queue
+                    logger.info("Switching to LIVE status")
+                    self.put_notification(LIVE)
+            if self._load_live(msg):
+                return True
+
+            logger.info("Message not processed, continuing to next message")
+
+        return self._CONTINUE
+
+    def _handle_hist(self):
+        if self._histbars is not None:
+            for bar in self._histbars:
+                if self._load_history_bar(bar):
+                    return True  # loading worked
+
+            self._histbars = None  # block consumed
+
+        self.o.flush_candles()  # all datas have started by now
+        msg = self.qhist.get()
+        if msg is None:  # Conn broken during historical/backfilling
+            # Situation not managed. Simply bail out
+            self.put_notification(self.DISCONNECTED)
+            self._state = self._ST_OVER
+            return False  # error management cancelled the queue
+
+        elif isinstance(msg, pd.DataFrame):
+            self._preload_history(msg)
+            return self._CONTINUE
+
+        elif 'code' in msg:  # Error
+            self.put_notification(self.NOTSUBSCRIBED)
+            self.put_notification(self.DISCONNECTED)
+            self._state = self._ST_OVER
             return False
 
-        while True:
-            if self._state == self._ST_LIVE:
-                try:
-                    msg = (self._storedmsg.pop(None, None) or
-                           self.qlive.get(timeout=self._qcheck))
-                except queue.Empty:
-                    return None  # indicate timeout situation
-
-                if msg is None:  # Conn broken during historical/backfilling
-                    logger.warning("Connection broken during historical/backfilling")
-                    self.put_notification(self.CONNBROKEN)
-                    # Try to reconnect
-                    if not self.p.reconnect or self._reconns == 0:
-                        logger.error("Cannot reconnect - no more attempts left")
-                        self.put_notification(self.DISCONNECTED)
-                        self._state = self._ST_OVER
-                        return False  # failed
-
-                    self._reconns -= 1
-                    logger.debug(f"Attempting reconnection, attempts left: {self._reconns}")
-                    self._st_start(instart=False, tmout=self.p.reconntimeout)
-                    continue
-
-                if 'code' in msg:
-                    logger.warning(f"Received error code in message: {msg['code']}")
-                    self.put_notification(self.CONNBROKEN)
-                    code = msg['code']
-                    if code not in [599, 598, 596]:
-                        logger.error(f"Unrecoverable error code: {code}")
-                        self.put_notification(self.DISCONNECTED)
-                        self._state = self._ST_OVER
-                        return False  # failed
-
-                    if not self.p.reconnect or self._reconns == 0:
-                        logger.error("Cannot reconnect - no more attempts left")
-                        self.put_notification(self.DISCONNECTED)
-                        self._state = self._ST_OVER
-                        return False  # failed
-
-                    # Can reconnect
-                    self._reconns -= 1
-                    logger.debug(f"Attempting reconnection after error, attempts left: {self._reconns}")
-                    self._st_start(instart=False, tmout=self.p.reconntimeout)
-                    continue
-
-                self._reconns = self.p.reconnections
-
-                # Process the message according to expected return type
-                if not self._statelivereconn:
-                    if self._laststatus != self.LIVE:
-                        if self.qlive.qsize() <= 1:  # very short live queue
-                            logger.info("Switching to LIVE status")
-                            self.put_notification(self.LIVE)
-                    if self.p.timeframe == bt.TimeFrame.Ticks:
-                        ret = self._load_tick(msg)
-                    elif self.p.timeframe == bt.TimeFrame.Minutes:
-                        ret = self._load_agg(msg)
-                    else:
-                        # might want to act differently in the future
-                        ret = self._load_agg(msg)
-                    if ret:
-                        return True
-
-                    logger.info("Message not processed, continuing to next message")
-                    continue
-
-            elif self._state == self._ST_HISTORBACK:
-                msg = self.qhist.get()
-                if msg is None:  # Conn broken during historical/backfilling
-                    # Situation not managed. Simply bail out
-                    self.put_notification(self.DISCONNECTED)
-                    self._state = self._ST_OVER
-                    return False  # error management cancelled the queue
-
-                elif 'code' in msg:  # Error
-                    self.put_notification(self.NOTSUBSCRIBED)
-                    self.put_notification(self.DISCONNECTED)
-                    self._state = self._ST_OVER
-                    return False
-
-                if msg:
-                    if self._load_history(msg):
-                        return True  # loading worked
-
-                    continue  # not loaded ... date may have been seen
-                else:
-                    # End of histdata
-                    if self.p.historical:  # only historical
-                        self.put_notification(self.DISCONNECTED)
-                        self._state = self._ST_OVER
-                        return False  # end of historical
-
-                # Live is also wished - go for it
-                self._state = self._ST_LIVE
-                continue
-
-            elif self._state == self._ST_FROM:
-                if not self.p.backfill_from.next():
-                    # additional data source is consumed
-                    self._state = self._ST_START
-                    continue
-
-                # copy lines of the same name
-                for alias in self.lines.getlinealiases():
-                    lsrc = getattr(self.p.backfill_from.lines, alias)
-                    ldst = getattr(self.lines, alias)
-
-                    ldst[0] = lsrc[0]
+        if msg:
+            if self._load_history(msg):
+                return True  # loading worked
 
-                return True
+            return self._CONTINUE  # not loaded ... date may have been seen
+        else:
+            # End of histdata
+            if self.p.historical:  # only historical
+                self.put_notification(self.DISCONNECTED)
+                self._state = self._ST_OVER
+                return False  # end of historical
+
+        # Live is also wished - go for it
+        self._state = self._ST_LIVE
+        return self._CONTINUE
+
+    def _handle_from(self):
+        if not self.p.backfill_from.next():
+            # additional data source is consumed
+            self._state = self._ST_START
+            if len(self) > 1:  # pick up from the last copied bar
+                self._last_ts_ns = pd.Timestamp(
+                    num2date(self.lines.datetime[-1])).value
+            return self._CONTINUE
+
+        # copy lines of the same name
+        for lsrc, ldst in self._backfill_pairs:
+            ldst[0] = lsrc[0]
 
-            elif self._state == self._ST_START:
-                if not self._st_start(instart=False):
-                    self._state = self._ST_OVER
-                    return False
+        return True
+
+    def _handle_start(self):
+        if not self._st_start(instart=False):
+            self._state = self._ST_OVER
+            return False
+
+        return self._CONTINUE
+
+    def _reconn_tmout(self):
+        """
+        Returns the time to wait before the next reconnection attempt and
+        doubles the wait for the following one (capped exponential backoff)
+        """
+        jitter = random.uniform(0, self.p.reconn_jitter)
+        tmout = min(self._reconn_delay + jitter, self.p.reconn_backoff_max)
+        self._reconn_delay = min(self._reconn_delay * 2,
+                                 self.p.reconn_backoff_max)
+        return tmout
+
+    def _drain_backlog(self, msg):
+        """
+        The consumer is lagging behind the stream. Consume the pending
+        records now to bound the latency. Records not newer than the last
+        delivered one are dropped, then only the newest tick is kept and
+        bars are folded into one bar carrying the time and close of the
+        newest. Control messages (``None``, errors) are left in the queue
+        for ``_load``
+        """
+        pending = self.qlive.pop_records()
+        if not pending:
+            return msg
+
+        logger.warning("Live backlog: caught up over %d messages",
+                       len(pending))
+        last_ns = self._last_ts_ns
+        pending = [m for m in [msg] + pending if m.time > last_ns]
+        if not pending:
+            return msg  # all seen already: the loader rejects it
+
+        newest = max(pending, key=attrgetter('time'))
+        if self.p.timeframe == bt.TimeFrame.Ticks:
+            return newest
+
+        return newest._replace(open=pending[0].open,
+                               high=max(b.high for b in pending),
+                               low=min(b.low for b in pending),
+                               volume=sum(b.volume for b in pending))
 
     def _load_tick(self, msg):
-        dtobj = pd.Timestamp(msg['time'], unit='ns')
-        dt = date2num(dtobj)
-        if dt <= self.lines.datetime[-1]:
+        ns = msg.time
+        if ns <= self._last_ts_ns:
             return False  # time already seen
 
+        self._last_ts_ns = ns
+
         # Common fields
-        self.lines.datetime[0] = dt
-        self.lines.volume[0] = 0.0
-        self.lines.openinterest[0] = 0.0
+        self.lines.datetime[0] = self._BT_EPOCH + ns / self._NS_PER_DAY
 
         # Put the prices into the bar
-        tick = float(
-            msg['ask_price']) if self.p.useask else float(
-            msg['bid_price'])
+        tick = float(msg.ask_price) if self.p.useask else float(msg.bid_price)
         self.lines.open[0] = tick
         self.lines.high[0] = tick
         self.lines.low[0] = tick
@@ -426,28 +552,29 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
         return True
 
     def _load_agg(self, msg):
-        dtobj = pd.Timestamp(msg['time'], unit='ns')
-        dt = date2num(dtobj)
-        if dt <= self.lines.datetime[-1]:
+        ns, bopen, bhigh, blow, bclose, bvolume = msg
+        if ns <= self._last_ts_ns:
             logger.info("Skipping duplicate timestamp")
             return False  # time already seen
-        self.lines.datetime[0] = dt
-        self.lines.open[0] = msg['open']
-        self.lines.high[0] = msg['high']
-        self.lines.low[0] = msg['low']
-        self.lines.close[0] = msg['close']
-        self.lines.volume[0] = msg['volume']
+        self._last_ts_ns = ns
+        self.lines.datetime[0] = self._BT_EPOCH + ns / self._NS_PER_DAY
+        self.lines.open[0] = bopen
+        self.lines.high[0] = bhigh
+        self.lines.low[0] = blow
+        self.lines.close[0] = bclose
+        self.lines.volume[0] = bvolume
         self.lines.openinterest[0] = 0.0
         return True
 
     def _load_history(self, msg):
-        dtobj = msg['time'].to_pydatetime()
-        dt = date2num(dtobj)
-        if dt <= self.lines.datetime[-1]:
+        ns = msg['time'].value
+        if ns <= self._last_ts_ns:
             return False  # time already seen
 
+        self._last_ts_ns = ns
+
         # Common fields
-        self.lines.datetime[0] = dt
+        self.lines.datetime[0] = self._BT_EPOCH + ns / self._NS_PER_DAY
         self.lines.volume[0] = msg['volume']
         self.lines.openinterest[0] = 0.0
 
@@ -459,3 +586,36 @@ class AlpacaData(with_metaclass(MetaAlpacaData, DataBase)):
         self.lines.close[0] = msg['close']
 
         return True
+
+    def _preload_history(self, df):
+        """
+        Converts a block of historical bars in one vectorized pass. The
+        datetime conversion is done over the whole index and the columns are
+        turned into lists of Python floats (cheaper to compare and to store in
+        the line buffers than numpy scalars), leaving only the line writes for
+        each bar
+        """
+        ns = df.index.values.astype('datetime64[ns]').astype('int64')
+        dts = self._BT_EPOCH + ns / self._NS_PER_DAY
+        self._histbars = zip(ns.tolist(), dts.tolist(),
+                             df['open'].to_numpy(float).tolist(),
+                             df['high'].to_numpy(float).tolist(),
+                             df['low'].to_numpy(float).tolist(),
+                             df['close'].to_numpy(float).tolist(),
+                             df['volume'].to_numpy(float).tolist())
+
+    def _load_history_bar(self, bar):
+        ns, dt, bopen, bhigh, blow, bclose, bvolume = bar
+        if ns <= self._last_ts_ns:
+            return False  # time already seen
+
+        self._last_ts_ns = ns
+        self.lines.datetime[0] = dt
+        self.lines.open[0] = bopen
+        self.lines.high[0] = bhigh
+        self.lines.low[0] = blow
+        self.lines.close[0] = bclose
+        self.lines.volume[0] = bvolume
+        self.lines.openinterest[0] = 0.0
+
+        return True
@@ -2,17 +2,19 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import os
 import collections
+import functools
+import hashlib
 import pytz
 from enum import Enum
-import traceback
 
-from datetime import datetime, timedelta, time as dtime
+from datetime import datetime, timedelta, timezone
 import uuid
 from dateutil.parser import parse as date_parse
 import time as _time
 import exchange_calendars
 import threading
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 from alpaca.data.timeframe import TimeFrame
 from alpaca.data.live.websocket import DataStream
@@ -31,17 +33,35 @@ from alpaca.trading.stream import TradingStream
 from alpaca.data.enums import DataFeed
 from alpaca.data.requests import StockBarsRequest, CryptoBarsRequest, OptionBarsRequest
 from alpaca.common.exceptions import APIError
+from requests.adapters import HTTPAdapter
 import pytz
+import numpy as np
 import pandas as pd
 
 import backtrader as bt
 from backtrader.metabase import MetaParams
 from backtrader.utils.py3 import queue, with_metaclass
 
+try:
+    import uvloop  # optional: faster event loop for the streams
+except ImportError:
+    uvloop = None
+
 import logging
 logger = logging.getLogger(__name__)
 
 NY = 'America/New_York'
+_NY_TZ = pytz.timezone(NY)
+
+_NYSE_CAL = None  # built on first use: parsing the sessions is expensive
+
+
+def _get_nyse_cal():
+    global _NYSE_CAL
+    if _NYSE_CAL is None:
+        _NYSE_CAL = exchange_calendars.get_calendar(name='NYSE')
+
+    return _NYSE_CAL
 
 
 # Extend the exceptions to support extra cases
@@ -93,6 +113,325 @@ class StreamingMethod(Enum):
     MinuteAgg = "minute_agg"
 
 
+# Records published by the live streams. Positional access avoids hashing
+# string keys for every message; errors are still delivered as dicts
+StreamBar = collections.namedtuple(
+    'StreamBar', 'time open high low close volume')
+StreamQuote = collections.namedtuple(
+    'StreamQuote', 'time bid_price ask_price volume')
+
+# how bars are combined when resampling to a larger compression
+_OHLCV_AGG = {
+    'open': 'first',
+    'high': 'max',
+    'low': 'min',
+    'close': 'last',
+    'volume': 'sum',
+}
+
+# bars of a bars response, timestamps as ns since the epoch (UTC)
+_BAR_DTYPE = np.dtype([('timestamp', 'i8'),
+                       ('open', 'f8'),
+                       ('high', 'f8'),
+                       ('low', 'f8'),
+                       ('close', 'f8'),
+                       ('volume', 'f8')])
+
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_US = timedelta(microseconds=1)
+
+
+def _to_ns(dt):
+    '''Nanoseconds since the epoch of a datetime (naive ones taken as UTC)
+
+    Same result as ``pd.Timestamp(dt).value`` with plain datetime arithmetic,
+    which is several times cheaper for every streamed message
+    '''
+    if isinstance(dt, pd.Timestamp):
+        return dt.value  # may carry nanoseconds
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+
+    return (dt - _EPOCH_UTC) // _ONE_US * 1000
+
+
+def _new_request(request_cls, kw, **fields):
+    '''Order request of ``request_cls`` built straight from the order kwargs
+
+    The bracket legs are validated together with ``order_class``, hence
+    they are given at construction
+    '''
+    return request_cls(symbol=kw['symbol'], qty=kw['qty'], side=kw['side'],
+                       time_in_force=kw['time_in_force'],
+                       order_class=kw.get('order_class'),
+                       stop_loss=kw.get('stop_loss'),
+                       take_profit=kw.get('take_profit'),
+                       **fields)
+
+
+@functools.lru_cache(maxsize=128)
+def _initialize_dates(dtbegin, dtend, granularity):
+    '''Body of ``AlpacaStore._make_sure_dates_are_initialized_properly``
+
+    Cached: data feeds of a session mostly ask for the same explicit range,
+    and for minute bars each answer involves the NYSE calendar
+    '''
+    if not dtend:
+        dtend = pd.Timestamp('now', tz=NY)
+    else:
+        dtend = pd.Timestamp(pytz.utc.localize(dtend)) if \
+          not dtend.tzname() else dtend
+    if granularity == Granularity.Minute:
+        calendar = _get_nyse_cal()
+        minute = dtend.ceil(freq='min')
+        if not calendar.is_open_on_minute(minute):
+            # last traded minute of the latest session closed before
+            # dtend (handles weekends, holidays and early closes at once)
+            dtend = calendar.previous_close(minute).tz_convert(NY) - \
+                timedelta(minutes=1)
+    if not dtbegin:
+        days = 30 if granularity == Granularity.Daily else 3
+        delta = timedelta(days=days)
+        dtbegin = dtend - delta
+    else:
+        dtbegin = pd.Timestamp(pytz.utc.localize(dtbegin)) if \
+          not dtbegin.tzname() else dtbegin
+    while dtbegin > dtend:
+        # if we start the script during market hours we could get this
+        # situation. this resolves that.
+        dtbegin -= timedelta(days=1)
+    return dtbegin.astimezone(_NY_TZ), dtend.astimezone(_NY_TZ)
+
+
+class NotifiableDeque(object):
+    '''Single consumer queue backed by a ``collections.deque``
+
+    ``queue.Queue`` takes a mutex and a condition on every ``put``/``get``.
+    Appending to/popping from a deque is atomic, so only the consumer has to
+    wait on an event when the deque runs dry. ``get`` keeps the
+    ``queue.Queue`` contract and raises ``queue.Empty`` on timeout.
+
+    With ``maxlen`` the queue is bounded so that a stalled consumer cannot
+    make it grow without limit. Once full, ``overflow`` decides what is lost:
+    ``'drop_oldest'`` (the oldest pending record) or ``'drop_newest'`` (the
+    record being appended). Control messages (``None``, error dicts) are
+    never lost: they are always appended, evicting the oldest record to make
+    room, and are never evicted themselves. A control message at the head
+    of a full queue makes the appended record be dropped instead.
+    '''
+
+    _OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest')
+
+    def __init__(self, maxlen=None, overflow='drop_oldest'):
+        if overflow not in self._OVERFLOW_POLICIES:
+            raise ValueError(f"Unsupported overflow policy: {overflow}")
+
+        # bounded by hand: a deque maxlen would evict control messages too
+        self.dq = collections.deque()
+        self.maxlen = maxlen
+        self.ev = threading.Event()
+        self.drop_newest = overflow == 'drop_newest'
+        self.dropped = 0  # records lost to overflow
+
+    def __len__(self):
+        return len(self.dq)
+
+    def append(self, item):
+        dq = self.dq
+        if self.maxlen is not None and len(dq) >= self.maxlen:
+            control = item is None or isinstance(item, dict)
+            room = (control or not self.drop_newest) and self._evict_oldest()
+            if room or not control:  # a record is lost
+                self.dropped += 1
+                if self.dropped == 1:
+                    logger.warning("Queue full (%d): dropping records",
+                                   self.maxlen)
+
+            if not room and not control:
+                return
+
+        dq.append(item)
+        self.ev.set()
+
+    def _evict_oldest(self):
+        '''Drops the record at the head to make room, unless it is a control
+        message. Returns whether there is room now'''
+        dq = self.dq
+        try:
+            oldest = dq.popleft()
+        except IndexError:
+            return True  # emptied by the consumer meanwhile
+
+        if oldest is None or isinstance(oldest, dict):
+            dq.appendleft(oldest)  # left for the consumer
+            return False
+
+        return True
+
+    def extend(self, items):
+        if self.maxlen is not None:  # overflow handled item by item
+            for item in items:
+                self.append(item)
+            return
+
+        self.dq.extend(items)
+        self.ev.set()
+
+    def get(self, block=True, timeout=None):
+        try:
+            return self.dq.popleft()
+        except IndexError:
+            pass
+
+        if block:
+            self.ev.clear()
+            if not self.dq:  # re-check: append may have raced the clear
+                self.ev.wait(timeout)
+
+        try:
+            return self.dq.popleft()
+        except IndexError:
+            raise queue.Empty
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def drain(self, timeout=None):
+        '''Waits like ``get`` and returns a list with the first item and all
+        the others queued behind it, to handle a burst in one wakeup'''
+        items = [self.get(timeout=timeout)]
+        dq = self.dq
+        while dq:
+            items.append(dq.popleft())
+
+        return items
+
+    def pop_records(self):
+        '''Removes, without waiting, the records at the head of the queue
+        and returns them in a list. Stops at the first control message
+        (``None``, error dict), which is left for ``get``'''
+        records = []
+        dq = self.dq
+        while dq:
+            item = dq.popleft()
+            if item is None or isinstance(item, dict):
+                dq.appendleft(item)
+                break
+
+            records.append(item)
+
+        return records
+
+    def qsize(self):
+        return len(self.dq)
+
+
+class LatestSlot(object):
+    '''Single slot queue which only keeps the newest record
+
+    Meant for pure live consumers which only care about the latest bar/quote:
+    a stalled consumer does not build up a backlog of stale records, each
+    ``append`` replaces the pending one. ``None`` (connection broken) and
+    error dicts are never overwritten by a record arriving after them.
+    Offers the same interface as ``NotifiableDeque``.
+    '''
+
+    def __init__(self):
+        self.item = None
+        self.full = False
+        self.lock = threading.Lock()
+        self.ev = threading.Event()
+
+    def __len__(self):
+        return int(self.full)
+
+    def append(self, item):
+        with self.lock:
+            pending = self.item
+            if self.full and (pending is None or isinstance(pending, dict)):
+                return  # keep the control message
+
+            self.item = item
+            self.full = True
+
+        self.ev.set()
+
+    def _pop(self):
+        with self.lock:
+            if not self.full:
+                raise queue.Empty
+
+            item, self.item, self.full = self.item, None, False
+            return item
+
+    def get(self, block=True, timeout=None):
+        if block and not self.full:
+            self.ev.clear()
+            if not self.full:  # re-check: append may have raced the clear
+                self.ev.wait(timeout)
+
+        return self._pop()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def pop_records(self):
+        '''Same as ``NotifiableDeque.pop_records``: the pending record, if
+        any and not a control message'''
+        with self.lock:
+            item = self.item
+            if not self.full or item is None or isinstance(item, dict):
+                return []
+
+            self.item, self.full = None, False
+            return [item]
+
+    def qsize(self):
+        return len(self)
+
+
+class TokenBucket(object):
+    '''Thread-safe token bucket pacing requests to a rate limit
+
+    Holds up to ``capacity`` tokens, refilled at ``refill_per_sec``.
+    ``acquire`` takes one, sleeping until it is available, so bursts go
+    through untouched until the bucket runs dry.
+    '''
+
+    def __init__(self, capacity, refill_per_sec):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = float(capacity)
+        self.stamp = _time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = _time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.stamp) * self.refill_per_sec)
+                self.stamp = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+
+                wait = (1.0 - self.tokens) / self.refill_per_sec
+
+            _time.sleep(wait)
+
+
+class LoopQueue(asyncio.Queue):
+    '''``asyncio.Queue`` for a consumer task on the streams' event loop
+
+    Producers running on the same loop use ``append`` as they would with a
+    ``NotifiableDeque``, without any lock or cross-thread wakeup.
+    '''
+    append = asyncio.Queue.put_nowait
+
+
 class Streamer:
     conn: DataStream | TradingStream = None
 
@@ -131,50 +470,74 @@ class Streamer:
         self.instrument = instrument
         self.method = method
         self.q = q
+        # market data is demultiplexed per symbol: one connection can feed
+        # the queues of several datas
+        self.subs = dict()
+        if instrument is not None:
+            self.subs[instrument.symbol] = q
+
+    def subscribe(self, symbol, q):
+        '''Routes the messages for ``symbol`` to ``q`` over this connection'''
+        known = symbol in self.subs
+        self.subs[symbol] = q  # a reconnecting data replaces its queue
+        if not known:
+            self._subscribe(symbol)
+
+    def _subscribe(self, *symbols):
+        if self.method == StreamingMethod.MinuteAgg:
+            self.conn.subscribe_bars(self.on_agg_min, *symbols)
+        elif self.method == StreamingMethod.Quote:
+            self.conn.subscribe_quotes(self.on_quotes, *symbols)
 
-    def run(self):
+    def _subscribe_all(self):
         if self.method == StreamingMethod.AccountUpdate:
             self.conn.subscribe_trade_updates(self.on_trade)
-        elif self.method == StreamingMethod.MinuteAgg:
-            self.conn.subscribe_bars(self.on_agg_min, self.instrument.symbol)
-        elif self.method == StreamingMethod.Quote:
-            self.conn.subscribe_quotes(self.on_quotes, self.instrument.symbol)
+        else:
+            self._subscribe(*self.subs)
 
-        # this code runs in a new thread. we need to set the loop for it
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        self.conn.run()
+    def start(self, loop):
+        '''Runs the connection as a task of ``loop`` (running in another
+        thread) and returns the ``concurrent.futures.Future`` of the task'''
+        self._subscribe_all()
+        return asyncio.run_coroutine_threadsafe(self.conn._run_forever(), loop)
 
     async def on_listen(self, conn, stream, msg):
         pass
 
     async def on_quotes(self, msg):
+        q = self.subs.get(msg.symbol)
+        if q is None:
+            return  # no data listening (anymore) for the symbol
+
         # For Quote objects, we need to handle bid/ask prices that _load_tick expects
-        quote_dict = {
-            # Convert datetime object to pandas Timestamp to match expected format
-            'time': pd.Timestamp(msg.timestamp),
-            'bid_price': msg.bid_price if hasattr(msg, 'bid_price') else msg.close,
-            'ask_price': msg.ask_price if hasattr(msg, 'ask_price') else msg.close,
-            'volume': msg.volume if hasattr(msg, 'volume') else 0
-        }
-        self.q.put(quote_dict)
+        q.append(StreamQuote(
+            # nanoseconds since the epoch (UTC), converted by alpacadata
+            _to_ns(msg.timestamp),
+            msg.bid_price if hasattr(msg, 'bid_price') else msg.close,
+            msg.ask_price if hasattr(msg, 'ask_price') else msg.close,
+            msg.volume if hasattr(msg, 'volume') else 0,
+        ))
 
     async def on_agg_min(self, msg):
-        # Convert Bar object to a dictionary compatible with alpacadata
-        logger.debug(f"Streamer received minute aggregate: {msg}")
-        bar_dict = {
-            # Convert datetime object to pandas Timestamp to match expected format
-            'time': pd.Timestamp(msg.timestamp),
-            'open': msg.open,
-            'high': msg.high,
-            'low': msg.low,
-            'close': msg.close,
-            'volume': msg.volume
-        }
-        self.q.put(bar_dict)
+        # Convert Bar object to a record compatible with alpacadata
+        if logger.isEnabledFor(logging.DEBUG):  # skip the call per bar
+            logger.debug("Streamer received minute aggregate: %s", msg)
+        q = self.subs.get(msg.symbol)
+        if q is None:
+            return  # no data listening (anymore) for the symbol
+
+        q.append(StreamBar(
+            # nanoseconds since the epoch (UTC), converted by alpacadata
+            _to_ns(msg.timestamp),
+            msg.open,
+            msg.high,
+            msg.low,
+            msg.close,
+            msg.volume,
+        ))
 
     async def on_account(self, msg):
-        self.q.put(msg)
+        self.q.append(msg)
 
     async def on_trade(self, msg):
         try:
@@ -189,14 +552,14 @@ class Streamer:
                     'filled_avg_price': order.filled_avg_price,
                     'side': order.side.value
                 }
-                self.q.put(order_dict)
+                self.q.append(order_dict)
             else:
                 # Fallback for other message formats
-                self.q.put(msg)
-        except Exception as e:
-            print(f"Error processing trade update: {e}")
+                self.q.append(msg)
+        except Exception:
+            logger.exception("Error processing trade update")
             # Pass the original message as a fallback
-            self.q.put(msg)
+            self.q.append(msg)
 
 
 class MetaSingleton(MetaParams):
@@ -227,6 +590,35 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
 
       - ``account_tmout`` (default: ``10.0``): refresh period for account
         value/cash refresh
+
+      - ``use_uvloop`` (default: ``True``): run the streams on a ``uvloop``
+        event loop if the package is installed (not available on Windows)
+
+      - ``loop_workers`` (default: ``None``): threads available to the
+        streams' event loop for blocking calls (REST requests from the broker
+        callbacks). ``None`` reads the ``ALPACA_THREAD_POOL`` environment
+        variable, defaulting to ``8``
+
+      - ``stream_maxlen`` (default: ``10000``): maximum number of pending
+        live price records per data. ``None`` for an unbounded queue
+
+      - ``stream_overflow`` (default: ``'drop_oldest'``): which record is lost
+        when the live price queue is full: ``'drop_oldest'`` or
+        ``'drop_newest'``
+
+      - ``order_workers`` (default: ``4``): orders queued together are sent
+        to the server concurrently by up to this many threads
+
+      - ``rate_limit_per_min`` (default: ``200``): order submissions and
+        cancellations are paced locally to stay within this many requests
+        per minute (the server answers 429 above its limit). ``None``
+        disables the pacing
+
+      - ``bars_cache_dir`` (default: ``None``): directory where historical
+        bars of closed date ranges are kept once downloaded, per symbol (also
+        for the requests of several datas coalesced into one call). Later
+        requests for the same symbol, granularity and range are read from
+        disk instead of the server. ``None`` disables the cache
     '''
 
     BrokerCls = None  # broker class will autoregister
@@ -237,7 +629,14 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         ('secret_key', ''),
         ('paper', False),
         ('account_tmout', 10.0),  # account balance refresh timeout
-        ('api_version', None)
+        ('api_version', None),
+        ('use_uvloop', True),
+        ('loop_workers', None),  # executor size of the streams' loop
+        ('stream_maxlen', 10000),  # pending live price records per data
+        ('stream_overflow', 'drop_oldest'),
+        ('order_workers', 4),  # concurrent order submissions
+        ('rate_limit_per_min', 200),  # order requests per minute
+        ('bars_cache_dir', None),  # on-disk cache of historical bars
     )
 
     _DTEPOCH = datetime(1970, 1, 1)
@@ -245,6 +644,7 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
     _ENVLIVE = 'live'
     _ENV_PRACTICE_URL = 'https://paper-api.alpaca.markets'
     _ENV_LIVE_URL = 'https://api.alpaca.markets'
+    _INSTRUMENT_TTL = 3600.0  # seconds an asset lookup is served from cache
 
     @classmethod
     def getdata(cls, *args, **kwargs):
@@ -260,6 +660,7 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         super(AlpacaStore, self).__init__()
 
         self.notifs = collections.deque()  # store notifications for cerebro
+        self._notifs_lock = threading.Lock()
 
         self._env = None  # reference to cerebro for general notifications
         self.broker = None  # broker instance
@@ -268,6 +669,7 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         self._orders = collections.OrderedDict()  # map order.ref to oid
         self._ordersrev = collections.OrderedDict()  # map oid to order.ref
         self._transpend = collections.defaultdict(collections.deque)
+        self._filled = dict()  # oid -> (filled qty, filled value) so far
 
         if self.p.paper:
             self._oenv = self._ENVPRACTICE
@@ -281,10 +683,41 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         self.crypto_client = CryptoHistoricalDataClient(api_key=self.p.key_id, secret_key=self.p.secret_key)
         self.option_client = OptionHistoricalDataClient(api_key=self.p.key_id, secret_key=self.p.secret_key)
 
+        # the session already keeps connections alive, but its pool would
+        # drop the extra ones opened by concurrent order submissions
+        self.trading_client._session.mount('https://', HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max(10, self.p.order_workers + 2)))
+
+        # bars call and request class per asset class
+        self._bars_dispatch = {
+            AssetClass.US_EQUITY: (self.stock_client.get_stock_bars,
+                                   StockBarsRequest),
+            AssetClass.CRYPTO: (self.crypto_client.get_crypto_bars,
+                                CryptoBarsRequest),
+            AssetClass.US_OPTION: (self.option_client.get_option_bars,
+                                   OptionBarsRequest),
+        }
+
         self._cash = 0.0
         self._value = 0.0
         self._evt_acct = threading.Event()
 
+        self._asset_cache = dict()  # dataname -> (monotonic time, asset)
+        self._asset_class_cache = dict()  # symbol -> AssetClass
+
+        # price streams shared by the datas: (asset class, method, feed) keys
+        self._streamers = dict()
+        self._streamers_lock = threading.Lock()
+
+        # deferred candles requests, coalesced by flush_candles
+        self._pending_candles = list()
+        self._candles_lock = threading.Lock()
+
+        # all the streams run as tasks of a single event loop
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
     def start(self, data=None, broker=None):
         # Datas require some processing to kickstart data reception
         if data is None and broker is None:
@@ -301,23 +734,30 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
 
         elif broker is not None:
             self.broker = broker
+            # keep the asset lookups of the known datas off the order path
+            self._prime_asset_cache(
+                d._name or d._dataname for d in broker.cerebro.datas)
             self.streaming_events()
             self.broker_threads()
 
     def stop(self):
         # signal end of thread
         if self.broker is not None:
-            self.q_ordercreate.put(None)
-            self.q_orderclose.put(None)
+            self._put_order_create(None)
+            self.q_orderclose.append(None)
             self.q_account.put(None)
 
     def put_notification(self, msg, *args, **kwargs):
-        self.notifs.append((msg, args, kwargs))
+        with self._notifs_lock:
+            self.notifs.append((msg, args, kwargs))
 
     def get_notifications(self):
         '''Return the pending "store" notifications'''
-        self.notifs.append(None)  # put a mark / threads could still append
-        return [x for x in iter(self.notifs.popleft, None)]
+        # swap in an empty deque: the lock keeps threads from appending to
+        # the deque being handed out
+        with self._notifs_lock:
+            notifs, self.notifs = self.notifs, collections.deque()
+        return list(notifs)
 
     # Alpaca supported granularities
     _GRANULARITIES = {
@@ -344,29 +784,95 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
             return Granularity.Daily
 
     def get_instrument(self, dataname):
+        # asset metadata does not change during a session: serve lookups
+        # (failed ones included) from a cache for _INSTRUMENT_TTL seconds
+        now = _time.monotonic()
+        entry = self._asset_cache.get(dataname)
+        if entry is not None and now - entry[0] < self._INSTRUMENT_TTL:
+            return entry[1]
+
         try:
             insts = self.trading_client.get_asset(dataname)
         except (AlpacaError, AlpacaRequestError,):
-            return None
+            insts = None
+
+        insts = insts or None
+        self._asset_cache[dataname] = (now, insts)
+        return insts
+
+    def _asset_class(self, symbol):
+        '''Returns the ``AssetClass`` of ``symbol``, asking the server only
+        the first time the symbol is seen'''
+        if '/' in symbol:  # only crypto pairs are quoted as BASE/QUOTE
+            return AssetClass.CRYPTO
+
+        # the class of an asset never changes: cache it for the process
+        asset_class = self._asset_class_cache.get(symbol)
+        if asset_class is None:
+            asset_class = self.trading_client.get_asset(symbol).asset_class
+            self._asset_class_cache[symbol] = asset_class
+
+        return asset_class
+
+    def _prime_asset_cache(self, symbols):
+        '''Fills the asset class cache for ``symbols`` ahead of the first
+        order. Failed lookups are left for ``order_create`` to retry'''
+        for symbol in dict.fromkeys(symbols):  # unique, in order
+            if symbol in self._asset_class_cache:
+                continue
 
-        return insts or None
+            asset = self.get_instrument(symbol)
+            if asset is not None:
+                self._asset_class_cache[symbol] = asset.asset_class
+
+    def _get_loop(self):
+        '''Returns the event loop shared by the streams, starting the thread
+        which runs it on first use'''
+        with self._loop_lock:
+            if self._loop is None:
+                if self.p.use_uvloop and uvloop is not None:
+                    loop = uvloop.new_event_loop()
+                else:
+                    loop = asyncio.new_event_loop()
 
-    def streaming_events(self, tmout=None):
-        q = queue.Queue()
-        kwargs = {'q': q, 'tmout': tmout}
+                # pool used by to_thread for the blocking REST calls
+                workers = self.p.loop_workers
+                if workers is None:
+                    workers = int(os.getenv('ALPACA_THREAD_POOL', '8'))
+                loop.set_default_executor(ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix='alpaca'))
+                t = threading.Thread(target=loop.run_forever)
+                t.daemon = True
+                t.start()
+                self._loop = loop
 
-        t = threading.Thread(target=self._t_streaming_listener, kwargs=kwargs)
-        t.daemon = True
-        t.start()
+        return self._loop
 
+    def streaming_events(self, tmout=None):
+        # the trade updates are produced and consumed on the streams' loop
+        q = LoopQueue()
+        asyncio.run_coroutine_threadsafe(self._a_streaming_listener(q),
+                                         self._get_loop())
+
+        kwargs = {'q': q, 'tmout': tmout}
         t = threading.Thread(target=self._t_streaming_events, kwargs=kwargs)
         t.daemon = True
         t.start()
         return q
 
-    def _t_streaming_listener(self, q, tmout=None):
+    async def _a_streaming_listener(self, q):
         while True:
-            trans = q.get()
+            # take the whole burst queued behind the first event
+            batch = [await q.get()]
+            while not q.empty():
+                batch.append(q.get_nowait())
+
+            # the broker callbacks issue blocking REST calls: keep them off
+            # the loop, which also runs the price streams
+            await asyncio.to_thread(self._process_events, batch)
+
+    def _process_events(self, batch):
+        for trans in batch:
             # Check if trans is already in the expected dictionary format
             # or if it has the order attribute (old format)
             if isinstance(trans, dict):
@@ -377,8 +883,8 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                 # Try to handle anyway
                 try:
                     self._transaction(trans)
-                except Exception as e:
-                    print(f"Error processing transaction: {e}")
+                except Exception:
+                    logger.exception("Error processing stream transaction")
 
     def _t_streaming_events(self, q, tmout=None):
         if tmout is not None:
@@ -388,10 +894,10 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                             api_secret=self.p.secret_key,
                             )
 
-        streamer.run()
+        streamer.start(self._get_loop())
 
     def candles(self, dataname, dtbegin, dtend, timeframe, compression,
-                candleFormat, includeFirst):
+                candleFormat, includeFirst, dataframe=False, defer=False):
         """
 
         :param dataname: symbol name. e.g AAPL
@@ -402,17 +908,56 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                  get sample every day. if 3 => get sample every 3 days
         :param candleFormat: (bidask, midpoint, trades) - not used we get bars
         :param includeFirst:
+        :param dataframe: if True all the bars are delivered as a single
+                 pandas DataFrame message instead of one dict per bar
+        :param defer: if True the download waits for ``flush_candles``, so
+                 that the requests of several datas for the same period can
+                 be sent as a single multi-symbol request
         :return:
         """
 
-        kwargs = locals().copy()
-        kwargs.pop('self')
-        kwargs['q'] = q = queue.Queue()
-        t = threading.Thread(target=self._t_candles, kwargs=kwargs)
+        q = NotifiableDeque()
+        args = (dataname, dtbegin, dtend, timeframe, compression,
+                candleFormat, includeFirst, dataframe, q)
+        if defer:
+            with self._candles_lock:
+                self._pending_candles.append(args)
+            return q
+
+        t = threading.Thread(target=self._t_candles, args=args)
         t.daemon = True
         t.start()
         return q
 
+    def flush_candles(self):
+        """
+        starts the deferred candles downloads. requests for the same period
+        and granularity of the same asset class are coalesced into a single
+        multi-symbol request
+        """
+        if not self._pending_candles:
+            return
+
+        with self._candles_lock:
+            pending, self._pending_candles = self._pending_candles, []
+
+        groups = collections.defaultdict(list)
+        for args in pending:
+            dataname, dtbegin, dtend, timeframe, compression = args[:5]
+            asset = self.get_instrument(dataname)
+            key = (getattr(asset, 'asset_class', None), dtbegin, dtend,
+                   timeframe, compression)
+            groups[key].append(args)
+
+        for reqs in groups.values():
+            if len(reqs) == 1:
+                t = threading.Thread(target=self._t_candles, args=reqs[0])
+            else:
+                t = threading.Thread(target=self._t_candles_batch,
+                                     args=(reqs,))
+            t.daemon = True
+            t.start()
+
     @staticmethod
     def iso_date(date_str):
         """
@@ -424,14 +969,14 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         return date_parse(date_str).date().isoformat()
 
     def _t_candles(self, dataname, dtbegin, dtend, timeframe, compression,
-                   candleFormat, includeFirst, q):
+                   candleFormat, includeFirst, dataframe, q):
         granularity: Granularity = self.get_granularity(timeframe, compression)
         dtbegin, dtend = self._make_sure_dates_are_initialized_properly(
             dtbegin, dtend, granularity)
 
         if granularity is None:
             e = AlpacaTimeFrameError('granularity is missing')
-            q.put(e.error_response)
+            q.append(e.error_response)
             return
         try:
             cdl = self.get_aggs_from_alpaca(dataname,
@@ -440,29 +985,78 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                                             granularity,
                                             compression)
         except AlpacaError as e:
-            print(str(e))
-            q.put(e.error_response)
-            q.put(None)
+            logger.exception("Error fetching bars of %s", dataname)
+            q.append(e.error_response)
+            q.append(None)
+            return
+        except Exception:
+            logger.exception("Error fetching bars of %s", dataname)
+            q.append({'code': 'error'})
+            q.append(None)
+            return
+
+        self._deliver_candles(cdl, dtbegin, dtend, dataframe, q)
+
+    def _t_candles_batch(self, reqs):
+        dataname, dtbegin, dtend, timeframe, compression = reqs[0][:5]
+        granularity: Granularity = self.get_granularity(timeframe, compression)
+        if granularity is None:
+            e = AlpacaTimeFrameError('granularity is missing')
+            for args in reqs:
+                args[-1].append(e.error_response)
+            return
+
+        dtbegin, dtend = self._make_sure_dates_are_initialized_properly(
+            dtbegin, dtend, granularity)
+        symbols = [args[0] for args in reqs]
+        try:
+            cdls = self.get_aggs_from_alpaca(symbols,
+                                             dtbegin,
+                                             dtend,
+                                             granularity,
+                                             compression)
+        except AlpacaError as e:
+            logger.exception("Error fetching bars of %s", symbols)
+            for args in reqs:
+                args[-1].append(e.error_response)
+                args[-1].append(None)
             return
         except Exception:
-            traceback.print_exc()
-            q.put({'code': 'error'})
-            q.put(None)
+            logger.exception("Error fetching bars of %s", symbols)
+            for args in reqs:
+                args[-1].append({'code': 'error'})
+                args[-1].append(None)
             return
 
+        for args in reqs:
+            dataname, dataframe, q = args[0], args[-2], args[-1]
+            cdl = cdls.get(dataname)
+            if cdl is None:
+                q.append({})  # no bars for the symbol: end of transmission
+                continue
+
+            self._deliver_candles(cdl, dtbegin, dtend, dataframe, q)
+
+    def _deliver_candles(self, cdl, dtbegin, dtend, dataframe, q):
         # don't use dt.replace. use localize
         # (https://stackoverflow.com/a/1592837/2739124)
         cdl = cdl.loc[
-              pytz.timezone(NY).localize(dtbegin) if
+              _NY_TZ.localize(dtbegin) if
               not dtbegin.tzname() else dtbegin:
-              pytz.timezone(NY).localize(dtend) if
+              _NY_TZ.localize(dtend) if
               not dtend.tzname() else dtend
               ].dropna(subset=['high'])
-        records = cdl.reset_index().to_dict('records')
-        for r in records:
-            r['time'] = r['timestamp']
-            q.put(r)
-        q.put({})  # end of transmission
+        if dataframe:
+            q.append(cdl)
+        else:
+            # records straight from the columns (no reset_index copy),
+            # delivered in one batch
+            records = cdl.to_dict('records')
+            for ts, r in zip(cdl.index, records):
+                r['time'] = r['timestamp'] = ts
+
+            q.extend(records)
+        q.append({})  # end of transmission
 
     def _make_sure_dates_are_initialized_properly(self, dtbegin: pd.Timestamp | None, dtend: pd.Timestamp | None,
                                                   granularity: Granularity):
@@ -479,30 +1073,9 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         :return:
         """
         if not dtend:
-            dtend = pd.Timestamp('now', tz=NY)
-        else:
-            dtend = pd.Timestamp(pytz.timezone('UTC').localize(dtend)) if \
-              not dtend.tzname() else dtend
-        if granularity == Granularity.Minute:
-            calendar = exchange_calendars.get_calendar(name='NYSE')
-            while not calendar.is_open_on_minute(dtend.ceil(freq='min')):
-                dtend = dtend.replace(hour=15,
-                                      minute=59,
-                                      second=0,
-                                      microsecond=0)
-                dtend -= timedelta(days=1)
-        if not dtbegin:
-            days = 30 if granularity == Granularity.Daily else 3
-            delta = timedelta(days=days)
-            dtbegin = dtend - delta
-        else:
-            dtbegin = pd.Timestamp(pytz.timezone('UTC').localize(dtbegin)) if \
-              not dtbegin.tzname() else dtbegin
-        while dtbegin > dtend:
-            # if we start the script during market hours we could get this
-            # situation. this resolves that.
-            dtbegin -= timedelta(days=1)
-        return dtbegin.astimezone(pytz.timezone(NY)), dtend.astimezone(pytz.timezone(NY))
+            # relative to now: the result can't be reused
+            return _initialize_dates.__wrapped__(dtbegin, dtend, granularity)
+        return _initialize_dates(dtbegin, dtend, granularity)
 
     def get_aggs_from_alpaca(self,
                              dataname,
@@ -519,6 +1092,9 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         5 minute bars e.g) so we need to resample the received bars.
         also, we need to drop out of market records.
         this function does all of that.
+        dataname may also be a list of symbols of the same asset class. they
+        are then fetched with a single request and a dict of symbol -> frame
+        is returned (symbols without bars are left out).
         """
 
         def _granularity_to_timeframe(granularity):
@@ -534,6 +1110,36 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                 timeframe = TimeFrame.Day
             return timeframe
 
+        def _bars_endpoint(asset):
+            """
+            returns the bars call and its request class for the asset class
+            """
+            try:
+                return self._bars_dispatch[asset.asset_class]
+            except KeyError:
+                raise ValueError(
+                    f"Unsupported asset class: {asset.asset_class}")
+
+        def _bars_to_array(bars):
+            """
+            packs the bars into a single structured array: no dict or frame
+            per bar/page, one frame is built once all pages are in
+            """
+            return np.fromiter(
+                ((_to_ns(bar.timestamp), bar.open, bar.high, bar.low,
+                  bar.close, bar.volume) for bar in bars),
+                dtype=_BAR_DTYPE, count=len(bars))
+
+        def _array_to_frame(arr):
+            index = pd.DatetimeIndex(arr['timestamp'].view('datetime64[ns]'),
+                                     name='timestamp').tz_localize('UTC')
+            return pd.DataFrame({'open': arr['open'],
+                                 'high': arr['high'],
+                                 'low': arr['low'],
+                                 'close': arr['close'],
+                                 'volume': arr['volume']},
+                                index=index)
+
         def _iterate_api_calls():
             """
             you could get max 1000 samples from the server. if we need more
@@ -544,37 +1150,19 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
             """
             got_all = False
             curr = end
-            response = pd.DataFrame()
+            pages = []  # newest first
+            # neither the asset nor the timeframe change between pages
+            timeframe = _granularity_to_timeframe(granularity)
+            fetch, request_cls = _bars_endpoint(self.get_instrument(dataname))
             while not got_all:
-                timeframe = _granularity_to_timeframe(granularity)
-                asset = self.get_instrument(dataname)
-                if asset.asset_class == AssetClass.US_EQUITY:
-                    r = self.stock_client.get_stock_bars(
-                        StockBarsRequest(
-                            symbol_or_symbols=dataname,
-                            timeframe=timeframe,
-                            start=start.isoformat(),
-                            end=curr.isoformat()
-                        )
-                    )
-                elif asset.asset_class == AssetClass.CRYPTO:
-                    r = self.crypto_client.get_crypto_bars(
-                        CryptoBarsRequest(
-                            symbol_or_symbols=dataname,
-                            timeframe=timeframe,
-                            start=start.isoformat(),
-                            end=curr.isoformat()
-                        )
-                    )
-                elif asset.asset_class == AssetClass.US_OPTION:
-                    r = self.option_client.get_option_bars(
-                        OptionBarsRequest(
-                            symbol_or_symbols=dataname,
-                            timeframe=timeframe,
-                            start=start.isoformat(),
-                            end=curr.isoformat()
-                        )
+                r = fetch(
+                    request_cls(
+                        symbol_or_symbols=dataname,
+                        timeframe=timeframe,
+                        start=start,
+                        end=curr
                     )
+                )
                 if r and dataname in r.data and len(r.data[dataname]) > 0:
                     # BarSet contains a dict with symbol as key and List[Bar] as value
                     bars = r.data[dataname]
@@ -582,22 +1170,9 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                     earliest_sample = bars[0].timestamp
                     
                     # Convert the bars to a DataFrame
-                    bar_dicts = [{
-                        'open': bar.open,
-                        'high': bar.high,
-                        'low': bar.low,
-                        'close': bar.close,
-                        'volume': bar.volume,
-                        'timestamp': bar.timestamp
-                    } for bar in bars]
+                    pages.append(_bars_to_array(bars))
                     
-                    bar_df = pd.DataFrame(bar_dicts)
-                    # Set timestamp as index
-                    bar_df.set_index('timestamp', inplace=True)
-                    
-                    response = pd.concat([bar_df, response], axis=0)
-                    
-                    if earliest_sample <= (pytz.timezone(NY).localize(
+                    if earliest_sample <= (_NY_TZ.localize(
                             start) if not start.tzname() else start):
                         got_all = True
                     else:
@@ -607,7 +1182,12 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                 else:
                     # no more data is available, let's return what we have
                     break
-            return response
+
+            if not pages:
+                return np.empty(0, dtype=_BAR_DTYPE)
+
+            # a single concat: growing the frame page by page is quadratic
+            return np.concatenate(pages[::-1])
 
         def _clear_out_of_market_hours(df):
             """
@@ -615,15 +1195,6 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
             """
             return df.between_time("09:30", "16:00")
 
-        def _drop_early_samples(df):
-            """
-            samples from server don't start at 9:30 NY time
-            let's drop earliest samples
-            """
-            for i, b in df.iterrows():
-                if i.time() >= dtime(9, 30):
-                    return df[i:]
-
         def _resample(df):
             """
             samples returned with certain window size (1 day, 1 minute) user
@@ -634,85 +1205,122 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                 sample_size = f"{compression}Min"
             else:
                 sample_size = f"{compression}D"
-            df = df.resample(sample_size).agg(
-                collections.OrderedDict([
-                    ('open', 'first'),
-                    ('high', 'max'),
-                    ('low', 'min'),
-                    ('close', 'last'),
-                    ('volume', 'sum'),
-                ])
-            )
+            df = df.resample(sample_size).agg(_OHLCV_AGG)
             if granularity == Granularity.Minute:
                 return df.between_time("09:30", "16:00")
             else:
                 return df
 
+        def _finish(cdl):
+            if granularity == Granularity.Minute:
+                # also drops the samples before 9:30, no second pass needed
+                cdl = _clear_out_of_market_hours(cdl)
+            if compression != 1:
+                response = _resample(cdl)
+            else:
+                response = cdl
+            response = response.dropna()
+            response = response[~response.index.duplicated()]
+            return response
+
+        if not isinstance(dataname, str):
+            # symbols cached on disk are read from there, the others are
+            # fetched together (the sdk pages through all of them)
+            symbols = list(dataname)
+            arrs, caches = dict(), dict()
+            for symbol in symbols:
+                cache = self._bars_cache_path(symbol, granularity, start, end)
+                if cache is not None and os.path.exists(cache):
+                    arrs[symbol] = np.load(cache)
+                else:
+                    caches[symbol] = cache
+
+            if caches:
+                fetch, request_cls = _bars_endpoint(
+                    self.get_instrument(symbols[0]))
+                r = fetch(
+                    request_cls(
+                        symbol_or_symbols=list(caches),
+                        timeframe=_granularity_to_timeframe(granularity),
+                        start=start,
+                        end=end
+                    )
+                )
+                data = r.data if r else {}
+                for symbol, cache in caches.items():
+                    arrs[symbol] = arr = _bars_to_array(data.get(symbol, []))
+                    if cache is not None:
+                        self._write_bars_cache(cache, arr)
+
+            return {symbol: _finish(_array_to_frame(arrs[symbol]))
+                    for symbol in symbols if len(arrs[symbol])}
+
         if not start:
             timeframe = _granularity_to_timeframe(granularity)
             start = end - timedelta(days=1)
-            asset = self.get_instrument(dataname)
-            if asset.asset_class == AssetClass.US_EQUITY:
-                r = self.stock_client.get_stock_bars(
-                    StockBarsRequest(
-                        symbol_or_symbols=dataname,
-                        timeframe=timeframe,
-                        start=start.isoformat(),
-                        end=end.isoformat()
-                    )
-                )
-            elif asset.asset_class == AssetClass.CRYPTO:
-                r = self.crypto_client.get_crypto_bars(
-                    CryptoBarsRequest(
-                        symbol_or_symbols=dataname,
-                        timeframe=timeframe,
-                        start=start.isoformat(),
-                        end=end.isoformat()
-                    )
-                )
-            elif asset.asset_class == AssetClass.US_OPTION:
-                r = self.option_client.get_option_bars(
-                    OptionBarsRequest(
-                        symbol_or_symbols=dataname,
-                        timeframe=timeframe,
-                        start=start.isoformat(),
-                        end=end.isoformat()
-                    )
+            fetch, request_cls = _bars_endpoint(self.get_instrument(dataname))
+            r = fetch(
+                request_cls(
+                    symbol_or_symbols=dataname,
+                    timeframe=timeframe,
+                    start=start,
+                    end=end
                 )
+            )
             # Convert BarSet to DataFrame
             if r and dataname in r.data and len(r.data[dataname]) > 0:
-                bars = r.data[dataname]
-                bar_dicts = [{
-                    'open': bar.open,
-                    'high': bar.high,
-                    'low': bar.low,
-                    'close': bar.close,
-                    'volume': bar.volume,
-                    'timestamp': bar.timestamp
-                } for bar in bars]
-                
-                response = pd.DataFrame(bar_dicts)
-                response.set_index('timestamp', inplace=True)
+                response = _array_to_frame(_bars_to_array(r.data[dataname]))
             else:
                 response = pd.DataFrame()
         else:
-            response = _iterate_api_calls()
-        cdl = response
-        if granularity == Granularity.Minute:
-            cdl = _clear_out_of_market_hours(cdl)
-            cdl = _drop_early_samples(cdl)
-        if compression != 1:
-            response = _resample(cdl)
-        else:
-            response = cdl
-        response = response.dropna()
-        response = response[~response.index.duplicated()]
-        return response
+            cache = self._bars_cache_path(dataname, granularity, start, end)
+            if cache is not None and os.path.exists(cache):
+                arr = np.load(cache)
+            else:
+                arr = _iterate_api_calls()
+                if cache is not None:
+                    self._write_bars_cache(cache, arr)
+
+            response = _array_to_frame(arr) if len(arr) else pd.DataFrame()
+        return _finish(response)
+
+    def _bars_cache_path(self, dataname, granularity, start, end):
+        '''Returns the file caching the bars of the request, ``None`` if the
+        cache is off or the range is still open (its bars may change)'''
+        cache_dir = self.p.bars_cache_dir
+        if cache_dir is None:
+            return None
+
+        end = pd.Timestamp(end)
+        if end.tzinfo is None:
+            end = end.tz_localize(NY)
+        if end >= pd.Timestamp.now(tz='UTC'):
+            return None
+
+        key = '|'.join((dataname, str(granularity),
+                        pd.Timestamp(start).isoformat(), end.isoformat()))
+        digest = hashlib.md5(key.encode()).hexdigest()
+        os.makedirs(cache_dir, exist_ok=True)
+        return os.path.join(cache_dir,
+                            f"{dataname.replace('/', '-')}_{digest}.npy")
+
+    @staticmethod
+    def _write_bars_cache(cache, arr):
+        # write aside and rename: readers never see half a file
+        tmp = f'{cache}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, arr)
+        os.replace(tmp, cache)
 
     def streaming_prices(self,
-                         dataname, timeframe, tmout=None, data_feed=DataFeed.IEX):
-        logger.debug(f"Starting streaming prices for {dataname} with timeframe {timeframe}")
-        q = queue.Queue()
+                         dataname, timeframe, tmout=None, data_feed=DataFeed.IEX,
+                         latest_only=False):
+        logger.debug("Starting streaming prices for %s with timeframe %s", dataname, timeframe)
+        if latest_only:
+            q = LatestSlot()
+        else:
+            q = NotifiableDeque(maxlen=self.p.stream_maxlen,
+                                overflow=self.p.stream_overflow)
         kwargs = {'q':         q,
                   'dataname':  dataname,
                   'timeframe': timeframe,
@@ -734,14 +1342,38 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         else:
             method = StreamingMethod.MinuteAgg
 
-        streamer = Streamer(q,
-                            instrument=self.get_instrument(dataname),
-                            api_key=self.p.key_id,
-                            api_secret=self.p.secret_key,
-                            method=method,
-                            data_feed=data_feed)
+        instrument = self.get_instrument(dataname)
+        key = (instrument.asset_class, method, data_feed)
+        with self._streamers_lock:
+            streamer = self._streamers.get(key)
+            shared = streamer is not None
+            if not shared:
+                streamer = Streamer(q,
+                                    instrument=instrument,
+                                    api_key=self.p.key_id,
+                                    api_secret=self.p.secret_key,
+                                    method=method,
+                                    data_feed=data_feed)
+                self._streamers[key] = streamer
+
+        # (un)subscribing waits on the event loop: never under the lock,
+        # which the loop takes when a connection ends
+        if shared:
+            # connection already running: multiplex the symbol over it
+            streamer.subscribe(instrument.symbol, q)
+            return
+
+        fut = streamer.start(self._get_loop())
+        fut.add_done_callback(
+            lambda f: self._streamer_done(key, streamer))
 
-        streamer.run()
+    def _streamer_done(self, key, streamer):
+        with self._streamers_lock:
+            if self._streamers.get(key) is streamer:
+                del self._streamers[key]
+
+        for sq in streamer.subs.values():
+            sq.append(None)  # connection gone: let the datas reconnect
 
     def get_cash(self):
         return self._cash
@@ -757,6 +1389,24 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         bt.Order.StopTrail: OrderType.TRAILING_STOP,
     }
 
+    _STOP_EXECS = frozenset((bt.Order.StopLimit, bt.Order.Stop))
+
+    # request for each order type, from the okwargs
+    _ORDER_REQUEST_BUILDERS = {
+        OrderType.MARKET: lambda kw: _new_request(MarketOrderRequest, kw),
+        OrderType.LIMIT: lambda kw: _new_request(
+            LimitOrderRequest, kw, limit_price=kw.get('limit_price')),
+        OrderType.STOP: lambda kw: _new_request(
+            StopOrderRequest, kw, stop_price=kw.get('stop_price')),
+        OrderType.STOP_LIMIT: lambda kw: _new_request(
+            StopLimitOrderRequest, kw, stop_price=kw.get('stop_price'),
+            limit_price=kw.get('limit_price')),
+        OrderType.TRAILING_STOP: lambda kw: _new_request(
+            TrailingStopOrderRequest, kw,
+            trail_percent=kw.get('trail_percent'),
+            trail_price=kw.get('trail_price')),
+    }
+
     def broker_threads(self):
         self.q_account = queue.Queue()
         self.q_account.put(True)  # force an immediate update
@@ -764,12 +1414,19 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         t.daemon = True
         t.start()
 
-        self.q_ordercreate = queue.Queue()
-        t = threading.Thread(target=self._t_order_create)
-        t.daemon = True
-        t.start()
+        rate = self.p.rate_limit_per_min
+        self._submit_bucket = None if rate is None else \
+            TokenBucket(capacity=rate, refill_per_sec=rate / 60.0)
 
-        self.q_orderclose = queue.Queue()
+        # orders are consumed by a task on the streams' loop
+        self.q_ordercreate = LoopQueue()
+        self._order_executor = ThreadPoolExecutor(
+            max_workers=self.p.order_workers,
+            thread_name_prefix='alpaca-orders')
+        asyncio.run_coroutine_threadsafe(self._a_order_create(),
+                                         self._get_loop())
+
+        self.q_orderclose = NotifiableDeque()
         t = threading.Thread(target=self._t_order_cancel)
         t.daemon = True
         t.start()
@@ -805,41 +1462,47 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         symbol = order.data._name if order.data._name else order.data._dataname
         okwargs['symbol'] = symbol
         
+        # Get asset class first to determine correct time_in_force
+        asset_class = self._asset_class(symbol)
+
+        # whole shares go as ints. Crypto and fractional shares keep the 9
+        # decimals the server accepts
         qty = abs(float(order.created.size))
-        qty = round(qty, 2)
+        if asset_class != AssetClass.CRYPTO and qty.is_integer():
+            qty = int(qty)
+        else:
+            qty = round(qty, 9)
         okwargs['qty'] = qty
             
         okwargs['side'] = OrderSide.BUY if order.isbuy() else OrderSide.SELL
         okwargs['type'] = self._ORDEREXECS[order.exectype]
         
-        # Get asset class first to determine correct time_in_force
-        asset = self.trading_client.get_asset(symbol)
         # For Crypto Trading, Alpaca only supports gtc, and ioc (https://alpaca.markets/docs/api-references/trading-api/orders/#time-in-force)
-        okwargs['time_in_force'] = TimeInForce.GTC if asset.asset_class == AssetClass.CRYPTO else TimeInForce.DAY
+        okwargs['time_in_force'] = TimeInForce.GTC if asset_class == AssetClass.CRYPTO else TimeInForce.DAY
         
         # Handle different order types and their prices
         if order.exectype == bt.Order.Market:
             # Market orders don't need a price
-            logger.debug(f"Creating market order for {symbol} - Side: {okwargs['side']}, Size: {okwargs['qty']}")
+            logger.debug("Creating market order for %s - Side: %s, Size: %s", symbol, okwargs['side'], okwargs['qty'])
         elif order.exectype == bt.Order.Limit:
             if order.price is not None:
                 okwargs['limit_price'] = order.price
-                logger.debug(f"Creating limit order for {symbol} - Side: {okwargs['side']}, Size: {okwargs['qty']}, Price: {okwargs['limit_price']}")
+                logger.debug("Creating limit order for %s - Side: %s, Size: %s, Price: %s", symbol, okwargs['side'], okwargs['qty'], okwargs['limit_price'])
             else:
-                logger.error(f"Limit order for {symbol} has no price!")
+                logger.error("Limit order for %s has no price!", symbol)
                 raise ValueError("Limit orders require a price")
-        elif order.exectype in [bt.Order.StopLimit, bt.Order.Stop]:
+        elif order.exectype in self._STOP_EXECS:
             if order.price is not None:
                 okwargs['stop_price'] = order.price
                 if order.exectype == bt.Order.StopLimit:
                     if order.created.pricelimit is not None:
                         okwargs['limit_price'] = order.created.pricelimit
                     else:
-                        logger.error(f"StopLimit order for {symbol} has no limit price!")
+                        logger.error("StopLimit order for %s has no limit price!", symbol)
                         raise ValueError("StopLimit orders require a limit price")
-                logger.debug(f"Creating stop order for {symbol} - Side: {okwargs['side']}, Size: {okwargs['qty']}, Stop: {okwargs['stop_price']}")
+                logger.debug("Creating stop order for %s - Side: %s, Size: %s, Stop: %s", symbol, okwargs['side'], okwargs['qty'], okwargs['stop_price'])
             else:
-                logger.error(f"Stop order for {symbol} has no price!")
+                logger.error("Stop order for %s has no price!", symbol)
                 raise ValueError("Stop orders require a price")
         elif order.exectype == bt.Order.StopTrail:
             if order.trailpercent and order.trailamount:
@@ -850,103 +1513,89 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                 okwargs['trail_price'] = order.trailamount
             else:
                 raise ValueError("You must provide either trailpercent or trailamount when creating StopTrail order")
-            logger.debug(f"Creating trailing stop order for {symbol} - Side: {okwargs['side']}, Size: {okwargs['qty']}")
+            logger.debug("Creating trailing stop order for %s - Side: %s, Size: %s", symbol, okwargs['side'], okwargs['qty'])
 
         if stopside:
-            okwargs['stop_loss'] = {'stop_price': str(stopside.price)}
-            logger.debug(f"Adding stop loss at {stopside.price}")
+            okwargs['stop_loss'] = {'stop_price': stopside.price}
+            logger.debug("Adding stop loss at %s", stopside.price)
 
         if takeside:
-            okwargs['take_profit'] = {'limit_price': str(takeside.price)}
-            logger.debug(f"Adding take profit at {takeside.price}")
+            okwargs['take_profit'] = {'limit_price': takeside.price}
+            logger.debug("Adding take profit at %s", takeside.price)
 
         if stopside or takeside:
-            okwargs['order_class'] = "bracket"
+            okwargs['order_class'] = OrderClass.BRACKET
             logger.debug("Creating bracket order")
 
         # anything from the user
         okwargs.update(order.info)
         okwargs.update(**kwargs)
 
-        logger.debug(f"Final order parameters: {okwargs}")
-        self.q_ordercreate.put((order.ref, okwargs,))
+        logger.debug("Final order parameters: %s", okwargs)
+        try:
+            order_request = self._order_request(okwargs)
+        except Exception as e:
+            logger.error("Error creating order %s: %s", order.ref, e)
+            self.put_notification(e)
+            self.broker._reject(order.ref)
+            return order
+
+        # the order task only has to send it
+        self._put_order_create((order.ref, order_request,))
         return order
 
-    def _t_order_create(self):
-        def _check_if_transaction_occurred(order_id):
-            # a transaction may have happened and was stored. if so let's
-            # process it
-            tpending = self._transpend[order_id]
-            tpending.append(None)  # eom marker
-            while True:
-                trans = tpending.popleft()
-                if trans is None:
-                    break
-                self._process_transaction(order_id, trans)
+    def _put_order_create(self, msg):
+        # the queue belongs to the loop: hand the message over to it
+        self._get_loop().call_soon_threadsafe(self.q_ordercreate.append, msg)
+
+    _ORDER_BURST = 25  # max queued orders sent together
 
+    async def _a_order_create(self):
+        loop = asyncio.get_running_loop()
         while True:
-            try:
+            # collect the orders queued meanwhile (ex: bracket legs, basket
+            # rebalances) to send them together instead of one RTT each
+            batch = [await self.q_ordercreate.get()]
+            while batch[-1] is not None and len(batch) < self._ORDER_BURST:
                 if self.q_ordercreate.empty():
-                    continue
-                msg = self.q_ordercreate.get()
-                if msg is None:
-                    continue
-                oref, okwargs = msg
-                try:
-                    logger.debug(f"Submitting order {oref} to Alpaca: {okwargs}")
-                    
-                    # Initialize order request based on order type
-                    basic_order_data = {
-                        "symbol": okwargs.get('symbol'),
-                        "qty": okwargs.get('qty'),
-                        "side": okwargs.get('side'),
-                        "time_in_force": okwargs.get('time_in_force')
-                    }
-                    order_type = okwargs.get('type')
-
-                    if order_type == OrderType.LIMIT:
-                        order_request = LimitOrderRequest(
-                            **basic_order_data,
-                            limit_price=okwargs.get('limit_price')
-                        )
-                    elif order_type == OrderType.STOP:
-                        order_request = StopOrderRequest(
-                            **basic_order_data,
-                            stop_price=okwargs.get('stop_price')
-                        )
-                    elif order_type == OrderType.STOP_LIMIT:
-                        order_request = StopLimitOrderRequest(
-                            **basic_order_data,
-                            stop_price=okwargs.get('stop_price'),
-                            limit_price=okwargs.get('limit_price')
-                        )
-                    elif order_type == OrderType.TRAILING_STOP:
-                        order_request = TrailingStopOrderRequest(
-                            **basic_order_data,
-                        )
-                        if 'trail_percent' in okwargs:
-                            order_request.trail_percent = okwargs.get('trail_percent')
-                        elif 'trail_price' in okwargs:
-                            order_request.trail_price = okwargs.get('trail_price')
-                    else:
-                        order_request = MarketOrderRequest(**basic_order_data)
-                    
-                    # Add bracket order parameters if present
-                    if okwargs.get('order_class') == 'bracket':
-                        order_request.order_class = OrderClass.BRACKET
-                        if 'stop_loss' in okwargs:
-                            order_request.stop_loss = okwargs.get('stop_loss')
-                        if 'take_profit' in okwargs:
-                            order_request.take_profit = okwargs.get('take_profit')
-
-                    logger.debug(f"Final order parameters: {order_request}")
-                    o = self.trading_client.submit_order(order_data=order_request)
-                    logger.debug(f"Order {oref} submitted successfully: {o}")
-                except Exception as e:
-                    logger.error(f"Error submitting order {oref}: {str(e)}")
-                    self.put_notification(e)
+                    break
+                batch.append(self.q_ordercreate.get_nowait())
+
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self._order_executor,
+                                     self._t_submit_order, *msg)
+                for msg in batch))
+
+            # the broker callbacks issue blocking REST calls: keep them off
+            # the loop, which also runs the price streams
+            await asyncio.to_thread(self._orders_submitted, batch, results)
+
+            if done:
+                break
+
+        self._order_executor.shutdown(wait=False)
+
+    def _orders_submitted(self, batch, results):
+        def _check_if_transaction_occurred(order_id, order_ref):
+            # a transaction may have happened and was stored. if so let's
+            # process it. The events thread appends to these: take the
+            # whole deque out of the dict in one step
+            for trans in self._transpend.pop(order_id, ()):
+                self._process_transaction(order_id, order_ref, trans)
+
+        # results come back in queue order: do the accounting here
+        for (oref, order_request), o in zip(batch, results):
+            try:
+                if isinstance(o, Exception):
+                    logger.error("Error submitting order %s: %s", oref, o)
+                    self.put_notification(o)
                     self.broker._reject(oref)
                     continue
+
                 try:
                     oid = o.id
                 except Exception:
@@ -960,55 +1609,92 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
                     self.broker._reject(oref)
                     continue
 
-                if okwargs['type'] == 'market':
-                    self.broker._accept(oref)  # taken immediately
-
                 self._orders[oref] = oid
                 self._ordersrev[oid] = oref  # maps ids to backtrader order
-                _check_if_transaction_occurred(oid)
+                _check_if_transaction_occurred(oid, oref)
                 if o.legs:
-                    index = 1
-                    for leg in o.legs:
-                        self._orders[oref + index] = leg.id
-                        self._ordersrev[leg.id] = oref + index
-                        _check_if_transaction_occurred(leg.id)
-                        index += 1
+                    # the legs take the references following the parent's
+                    leg_refs = {oref + i: leg.id
+                                for i, leg in enumerate(o.legs, 1)}
+                    self._orders.update(leg_refs)
+                    self._ordersrev.update(
+                        (lid, lref) for lref, lid in leg_refs.items())
+                    for lref, lid in leg_refs.items():
+                        _check_if_transaction_occurred(lid, lref)
                 self.broker._submit(oref)  # inside it submits the legs too
-                if okwargs['type'] == 'market':
+                if order_request.type == OrderType.MARKET:
                     self.broker._accept(oref)  # taken immediately
+            except Exception:
+                logger.exception("Error registering order %s", oref)
 
-            except Exception as e:
-                print(str(e))
+    def _t_submit_order(self, oref, order_request):
+        '''Sends an order to the server. Runs in the order executor: errors
+        are returned, to be handled by ``_orders_submitted``'''
+        try:
+            logger.debug("Submitting order %s to Alpaca: %s",
+                         oref, order_request)
+            if self._submit_bucket is not None:
+                self._submit_bucket.acquire()
+            o = self.trading_client.submit_order(order_data=order_request)
+            logger.debug("Order %s submitted successfully: %s", oref, o)
+            return o
+        except Exception as e:
+            return e
+
+    def _order_request(self, okwargs):
+        builder = self._ORDER_REQUEST_BUILDERS.get(
+            okwargs.get('type'), self._ORDER_REQUEST_BUILDERS[OrderType.MARKET])
+        return builder(okwargs)
 
     def order_cancel(self, order):
-        self.q_orderclose.put(order.ref)
+        self.q_orderclose.append(order.ref)
         return order
 
     def _t_order_cancel(self):
-        while True:
-            oref = self.q_orderclose.get()
-            if oref is None:
-                break
+        # a basket being closed arrives as a burst: cancel it concurrently
+        with ThreadPoolExecutor(max_workers=self.p.order_workers,
+                                thread_name_prefix='alpaca-cancels') as pool:
+            while True:
+                orefs = self.q_orderclose.drain()
+                done = None in orefs
+                if done:
+                    orefs = orefs[:orefs.index(None)]
+
+                cancels = [(oref, self._orders.get(oref))
+                           for oref in dict.fromkeys(orefs)]
+                # skip the orders which are no longer there
+                cancels = [(oref, oid) for oref, oid in cancels
+                           if oid is not None]
+
+                results = pool.map(self._t_cancel_order,
+                                   [oid for _, oid in cancels])
+                for (oref, oid), e in zip(cancels, results):
+                    if e is not None:
+                        self.put_notification(
+                            "Order not cancelled: {}, {}".format(oid, e))
+                        continue
 
-            oid = self._orders.get(oref, None)
-            if oid is None:
-                continue  # the order is no longer there
-            try:
-                self.trading_client.cancel_order(order_id=oid)
-            except Exception as e:
-                self.put_notification(
-                    "Order not cancelled: {}, {}".format(
-                        oid, e))
-                continue
+                    self.broker._cancel(oref)
+
+                if done:
+                    break
 
-            self.broker._cancel(oref)
+    def _t_cancel_order(self, oid):
+        '''Cancels an order on the server. Runs in the cancel pool: returns
+        the error, if any, to be notified by ``_t_order_cancel``'''
+        try:
+            if self._submit_bucket is not None:
+                self._submit_bucket.acquire()
+            self.trading_client.cancel_order(order_id=oid)
+        except Exception as e:
+            return e
 
-    _X_ORDER_CREATE = (
+    _X_ORDER_CREATE = frozenset((
         'new',
         'accepted',
         'pending_new',
         'accepted_for_bidding',
-    )
+    ))
 
     def _transaction(self, trans):
         # Invoked from Streaming Events. May actually receive an event for an
@@ -1017,40 +1703,53 @@ class AlpacaStore(with_metaclass(MetaSingleton, object)):
         try:
             oid = trans['id']
 
-            if not self._ordersrev.get(oid, False):
+            oref = self._ordersrev.get(oid)
+            if oref is None:
                 self._transpend[oid].append(trans)
             else:
-                self._process_transaction(oid, trans)
-        except Exception as e:
-            print(f"ERROR processing transaction: {e}")
-            traceback.print_exc()
-
-    _X_ORDER_FILLED = ('partially_filled', 'filled',)
+                self._process_transaction(oid, oref, trans)
+        except Exception:
+            logger.exception("Error processing stream transaction")
 
-    def _process_transaction(self, oid, trans):
-        try:
-            oref = self._ordersrev.pop(oid)
-        except KeyError:
-            return
+    _X_ORDER_FILLED = frozenset(('partially_filled', 'filled',))
 
+    def _process_transaction(self, oid, oref, trans):
+        # oref is the backtrader reference the caller found for oid. The
+        # mapping is only dropped once the order can no longer change
         ttype = trans['status']
 
         if ttype in self._X_ORDER_FILLED:
-            size = float(trans['filled_qty'])
+            # the updates carry the cumulative quantity and average price of
+            # the order: the broker gets what was filled since the last one
+            qty = float(trans['filled_qty'])
+            value = qty * float(trans['filled_avg_price'])
+            prev_qty, prev_value = self._filled.pop(oid, (0.0, 0.0))
+            if ttype == 'filled':
+                self._ordersrev.pop(oid, None)
+            else:
+                self._filled[oid] = (qty, value)
+
+            size = round(qty - prev_qty, 9)
+            if size <= 0:
+                return  # repeated update: nothing new filled
+
+            price = (value - prev_value) / size
             if trans['side'] == 'sell':
                 size = -size
-            price = float(trans['filled_avg_price'])
             self.broker._fill(oref, size, price, ttype=ttype)
 
         elif ttype in self._X_ORDER_CREATE:
             self.broker._accept(oref)
-            self._ordersrev[oid] = oref
 
         elif ttype == 'calculated':
             return
 
         elif ttype == 'expired':
+            self._ordersrev.pop(oid, None)
+            self._filled.pop(oid, None)
             self.broker._expire(oref)
         else:  # default action ... if nothing else
-            print("Process transaction - Order type: {}".format(ttype))
+            self._ordersrev.pop(oid, None)
+            self._filled.pop(oid, None)
+            logger.warning("Order %s rejected, status: %s", oref, ttype)
             self.broker._reject(oref)
@@ -0,0 +1,88 @@
+import alpaca_backtrader_api
+import backtrader as bt
+import numpy as np
+import pandas as pd
+import pytz
+from datetime import datetime
+from alpaca_backtrader_api.alpacastore import Granularity, NY
+
+# Your credentials here
+ALPACA_API_KEY = "<key_id>"
+ALPACA_SECRET_KEY = "<secret_key>"
+
+"""
+Parameter sweep of an SMA crossover over historical bars, using every core.
+
+The bars are downloaded once through the store and handed to the workers as
+a pandas frame: the store itself (API clients, threads) cannot be sent to
+other processes. With ``bars_cache_dir`` set, re-running the sweep reads the
+bars from disk instead of the server.
+"""
+SYMBOL = "AAPL"
+FROMDATE = datetime(2023, 1, 1)
+TODATE = datetime(2023, 12, 31)
+
+
+class SmaCross(bt.Strategy):
+    params = dict(
+        pfast=10,  # period for the fast moving average
+        pslow=30   # period for the slow moving average
+    )
+
+    def __init__(self):
+        # the bars are preloaded, so the whole crossover signal is computed
+        # in one vectorized pass instead of updating the moving averages and
+        # the crossover on every bar. Only the bars where it changes sign are
+        # kept: +1 fast crosses slow upwards, -1 downwards.
+        close = pd.Series(self.data.close.array)
+        fast = close.rolling(self.p.pfast).mean().to_numpy()
+        slow = close.rolling(self.p.pslow).mean().to_numpy()
+        change = np.nan_to_num(np.diff(np.sign(fast - slow), prepend=np.nan))
+        idx = np.flatnonzero(change)
+        self.signals = dict(zip(idx.tolist(), np.sign(change[idx]).tolist()))
+
+    def next(self):
+        signal = self.signals.get(len(self) - 1)
+        if signal is None:
+            return
+        if not self.position and signal > 0:
+            self.buy(size=5)  # enter long
+        elif self.position and signal < 0:
+            self.close()  # close long position
+
+def fetch_bars():
+    store = alpaca_backtrader_api.AlpacaStore(
+        key_id=ALPACA_API_KEY,
+        secret_key=ALPACA_SECRET_KEY,
+        paper=True,
+        bars_cache_dir='.bars_cache',
+    )
+    ny = pytz.timezone(NY)
+    df = store.get_aggs_from_alpaca(SYMBOL,
+                                    ny.localize(FROMDATE),
+                                    ny.localize(TODATE),
+                                    Granularity.Daily, 1)
+    # backtrader works with naive datetimes in the data timezone
+    df.index = df.index.tz_convert(ny).tz_localize(None)
+    return df
+
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+
+    cerebro = bt.Cerebro(optreturn=True)
+    cerebro.optstrategy(SmaCross,
+                        pfast=range(5, 25, 5),
+                        pslow=range(30, 70, 10))
+    cerebro.adddata(bt.feeds.PandasData(dataname=fetch_bars(), name=SYMBOL))
+    cerebro.broker.setcash(100000.0)
+    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
+
+    # one process per core: each runs its share of the parameter grid
+    results = cerebro.run(maxcpus=None)
+    for strats in results:
+        strat = strats[0]
+        print('pfast: {:2d} pslow: {:2d} return: {:.4f}'.format(
+            strat.p.pfast, strat.p.pslow,
+            strat.analyzers.returns.get_analysis()['rtot']))
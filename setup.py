@@ -43,5 +43,8 @@ setup(
     packages=['alpaca_backtrader_api'],
     install_requires=REQUIREMENTS,
     tests_require=REQUIREMENTS_TEST,
+    extras_require={
+        'uvloop': ['uvloop; platform_system != "Windows"'],
+    },
     setup_requires=['pytest-runner', 'flake8'],
 )
@@ -0,0 +1,33 @@
+import os
+
+import backtrader as bt
+import pytest
+
+# analyzers attached to every integration run: (class, name)
+_ANALYZERS = (
+    (bt.analyzers.SharpeRatio, 'sharpe'),
+    (bt.analyzers.DrawDown, 'drawdown'),
+    (bt.analyzers.Returns, 'returns'),
+    (bt.analyzers.TradeAnalyzer, 'trades'),
+)
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the live API tests up front when there are no credentials"""
+    if os.environ.get('ALPACA_API_KEY') and \
+            os.environ.get('ALPACA_SECRET_KEY'):
+        return
+    skip = pytest.mark.skip(
+        reason='ALPACA_API_KEY and ALPACA_SECRET_KEY not set in environment')
+    for item in items:
+        if 'live' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def cerebro():
+    """Cerebro with the analyzers the integration tests report on"""
+    cerebro = bt.Cerebro()
+    for analyzer, name in _ANALYZERS:
+        cerebro.addanalyzer(analyzer, _name=name)
+    return cerebro
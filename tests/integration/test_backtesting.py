@@ -48,27 +48,20 @@ class BuyAndHoldStrategy(bt.Strategy):
 
         print(f'TRADE PROFIT, Gross: {trade.pnl:.2f}, Net: {trade.pnlcomm:.2f}')
 
+# rate-limited API calls: keep out of parallel (xdist) runs; without
+# credentials the tests are skipped at collection (see conftest.py)
+pytestmark = [pytest.mark.serial, pytest.mark.live]
+
 @pytest.fixture
 def api_credentials():
-    """Fixture to provide API credentials and skip if not available"""
-    api_key = os.environ.get('ALPACA_API_KEY', '')
-    api_secret = os.environ.get('ALPACA_SECRET_KEY', '')
-    if not api_key or not api_secret:
-        pytest.skip('ALPACA_API_KEY and ALPACA_SECRET_KEY not set in environment')
-    return api_key, api_secret
+    """Fixture to provide API credentials"""
+    return os.environ['ALPACA_API_KEY'], os.environ['ALPACA_SECRET_KEY']
 
-def test_backtest_buy_and_hold(api_credentials, capsys):
+def test_backtest_buy_and_hold(api_credentials, cerebro, capsys):
     """Test strategy that buys at market open and sells at market close"""
     api_key, api_secret = api_credentials
-    cerebro = bt.Cerebro()
     cerebro.addstrategy(BuyAndHoldStrategy)
     
-    # Add analyzers
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
-    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trades')
-    
     # Initialize store with the API credentials
     store = AlpacaStore(
         key_id=api_key,
@@ -103,6 +96,7 @@ def test_backtest_buy_and_hold(api_credentials, capsys):
     # Extract strategy and analyzer results
     strat = results[0]
     trade_analysis = strat.analyzers.trades.get_analysis()
+    trade_totals = trade_analysis.get('total', {})
     
     # Test 1: Data Loading
     # Verify we have data points
@@ -110,7 +104,7 @@ def test_backtest_buy_and_hold(api_credentials, capsys):
     
     # Test 2: Order Processing
     # Verify we have exactly one complete trade (buy-sell cycle)
-    total_trades = trade_analysis.get('total', {}).get('total', 0)
+    total_trades = trade_totals.get('total', 0)
     assert total_trades == 1, f"Expected exactly 1 complete trade, got {total_trades}"
     
     # Test 3: Position Management
@@ -128,23 +122,28 @@ def test_backtest_buy_and_hold(api_credentials, capsys):
     # - No open trades (since we sold)
     # - One lost trade (since AAPL closed lower)
     # - No won trades
-    assert trade_analysis.get('total', {}).get('total', 0) == 1, "Expected exactly one complete trade"
-    assert trade_analysis.get('total', {}).get('open', 0) == 0, "Expected no open trades"
+    assert total_trades == 1, "Expected exactly one complete trade"
+    assert trade_totals.get('open', 0) == 0, "Expected no open trades"
     assert trade_analysis.get('won', {}).get('total', 0) == 0, "Expected no won trades"
     assert trade_analysis.get('lost', {}).get('total', 0) == 1, "Expected one lost trade"
     
-    # Log results for debugging
-    print('------ Test Results ------')
-    print(f'Initial Portfolio Value: {initial_value:.2f}')
-    print(f'Final Portfolio Value: {final_value:.2f}')
-    print(f'Total Return: {((final_value / initial_value) - 1) * 100:.2f}%')
+    # Log results for debugging, as a single write
+    report = [
+        '------ Test Results ------',
+        f'Initial Portfolio Value: {initial_value:.2f}',
+        f'Final Portfolio Value: {final_value:.2f}',
+        f'Total Return: {((final_value / initial_value) - 1) * 100:.2f}%',
+    ]
     
     # Log trade details
     if strat.buy_price:
-        print(f'Buy Price: {strat.buy_price:.2f}')
-        print(f'Final Price: {data0.close[0]:.2f}')
-        print(f'Position Size: {strat.position.size}')
-        print(f'Position Value: {strat.position.size * data0.close[0]:.2f}')
+        report += [
+            f'Buy Price: {strat.buy_price:.2f}',
+            f'Final Price: {data0.close[0]:.2f}',
+            f'Position Size: {strat.position.size}',
+            f'Position Value: {strat.position.size * data0.close[0]:.2f}',
+        ]
+    print('\n'.join(report))
     
     # If plotting is needed during development:
     # cerebro.plot() # Uncomment for visual inspection 
\ No newline at end of file
@@ -30,73 +30,66 @@ class DeterministicCryptoStrategy(bt.Strategy):
     def next(self):
         self.bar_count += 1
         self.data_received = True
-        current_dt = self.data.datetime.datetime(0)
-        
-        print(f'Bar #{self.bar_count} at {current_dt}: Price: {self.data.close[0]:.2f}')
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('Bar #%d at %s: Price: %.2f', self.bar_count,
+                        self.data.datetime.datetime(0), self.data.close[0])
         
         # Buy on first bar - only submit order if we haven't already
         if self.bar_count == 1 and not self.buy_order_submitted:
             self.order = self.buy()  # Small fixed size for testing
             self.buy_order_submitted = True
-            print(f'BUY ORDER CREATED at bar #{self.bar_count}, Price: {self.data.close[0]:.2f}')
+            logger.info('BUY ORDER CREATED at bar #%d, Price: %.2f', self.bar_count, self.data.close[0])
         
         # Sell on second bar - regardless of whether buy executed (the order won't execute if no position exists)
         elif self.bar_count == 2 and not self.sell_order_submitted:
             self.order = self.sell()  # Use same fixed size
             self.sell_order_submitted = True
-            print(f'SELL ORDER CREATED at bar #{self.bar_count}, Price: {self.data.close[0]:.2f}')
+            logger.info('SELL ORDER CREATED at bar #%d, Price: %.2f', self.bar_count, self.data.close[0])
         
         # Exit on third bar
         elif self.bar_count >= 3:
-            print(f'Reached maximum bars (3). Stopping strategy.')
+            logger.info('Reached maximum bars (3). Stopping strategy.')
             self.env.runstop()
     
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
             # Log when order is submitted/accepted
-            print(f"Order {order.ref} {order.getstatusname()}")
+            logger.info('Order %s %s', order.ref, order.getstatusname())
             return
 
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.buy_price = order.executed.price
-                print(f'BUY EXECUTED, Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Size: {order.executed.size}')
+                logger.info('BUY EXECUTED, Price: %.2f, Cost: %.2f, Size: %s', order.executed.price, order.executed.value, order.executed.size)
             else:  # Sell
-                print(f'SELL EXECUTED, Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Size: {order.executed.size}')
+                logger.info('SELL EXECUTED, Price: %.2f, Cost: %.2f, Size: %s', order.executed.price, order.executed.value, order.executed.size)
             self.order = None
         
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
-            print(f'Order {order.ref} {order.getstatusname()}')
+            logger.info('Order %s %s', order.ref, order.getstatusname())
             self.order = None
 
     def notify_trade(self, trade):
         if not trade.isclosed:
             return
 
-        print(f'TRADE PROFIT, Gross: {trade.pnl:.2f}, Net: {trade.pnlcomm:.2f}')
+        logger.info('TRADE PROFIT, Gross: %.2f, Net: %.2f', trade.pnl, trade.pnlcomm)
+
+# rate-limited API calls: keep out of parallel (xdist) runs; without
+# credentials the tests are skipped at collection (see conftest.py)
+pytestmark = [pytest.mark.serial, pytest.mark.live]
 
 @pytest.fixture
 def api_credentials():
-    """Fixture to provide API credentials and skip if not available"""
-    api_key = os.environ.get('ALPACA_API_KEY', '')
-    api_secret = os.environ.get('ALPACA_SECRET_KEY', '')
-    if not api_key or not api_secret:
-        pytest.skip('ALPACA_API_KEY and ALPACA_SECRET_KEY not set in environment')
-    return api_key, api_secret
+    """Fixture to provide API credentials"""
+    return os.environ['ALPACA_API_KEY'], os.environ['ALPACA_SECRET_KEY']
 
-def test_live_crypto_trading(api_credentials, capsys):
+def test_live_crypto_trading(api_credentials, cerebro, capsys):
     """Test a deterministic strategy for live crypto trading"""
     api_key, api_secret = api_credentials
     
-    cerebro = bt.Cerebro()
     cerebro.addstrategy(DeterministicCryptoStrategy)
     
-    # Add analyzers
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
-    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trades')
-    
     # Initialize store with the API credentials
     store = AlpacaStore(
         key_id=api_key,
@@ -168,15 +161,18 @@ def test_live_crypto_trading(api_credentials, capsys):
     
     # Instead of checking trades analysis (which only shows completed trades)
     # we can check if position size changed during the test
-    print('------ Test Results ------')
-    print(f'Bars processed: {strat.bar_count}')
-    print(f'Buy order submitted: {strat.buy_order_submitted}')
-    print(f'Sell order submitted: {strat.sell_order_submitted}')
+    report = [
+        '------ Test Results ------',
+        f'Bars processed: {strat.bar_count}',
+        f'Buy order submitted: {strat.buy_order_submitted}',
+        f'Sell order submitted: {strat.sell_order_submitted}',
+    ]
     
     if strat.buy_price:
-        print(f'Buy Price: {strat.buy_price:.2f}')
+        report.append(f'Buy Price: {strat.buy_price:.2f}')
     
     # Print trade analysis if available
     if trade_analysis:
         total_trades = trade_analysis.get('total', {}).get('total', 0)
-        print(f'Total trades executed: {total_trades}') 
\ No newline at end of file
+        report.append(f'Total trades executed: {total_trades}')
+    print('\n'.join(report)) 
\ No newline at end of file
@@ -0,0 +1,146 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import backtrader as bt
+import pandas as pd
+
+from alpaca_backtrader_api.alpacadata import AlpacaData
+from alpaca_backtrader_api.alpacastore import NotifiableDeque, LatestSlot, \
+    StreamBar, StreamQuote
+
+
+def _ns(hhmm):
+    """Epoch nanoseconds of a minute on 2024-01-02 (UTC)"""
+    return pd.Timestamp(f'2024-01-02 {hhmm}', tz='UTC').value
+
+def _bar(hhmm, close, high=None, low=None, volume=10):
+    return StreamBar(_ns(hhmm), close, high or close, low or close, close,
+                     volume)
+
+@pytest.fixture
+def make_data():
+    """Builds a started live AlpacaData on top of a mocked store, which
+    hands out the queue given as qlive"""
+    def make(qlive=None, **kwargs):
+        store = MagicMock()
+        store.streaming_prices.return_value = \
+            NotifiableDeque() if qlive is None else qlive
+        kwargs.setdefault('timeframe', bt.TimeFrame.Minutes)
+        kwargs.setdefault('backfill_start', False)
+        with patch.object(AlpacaData, '_store', return_value=store):
+            data = AlpacaData(dataname='AAPL', qcheck=0.01, **kwargs)
+        data.setenvironment(bt.Cerebro())
+        data._start()
+        return data
+
+    return make
+
+def test_backlog_folds_bars_into_newest(make_data):
+    """A backlog is folded into one bar with the newest time and close,
+    skipping records already delivered and keeping control messages."""
+    data = make_data(max_backlog=2)
+    q = data.qlive
+    q.append(_bar('13:30', 8.0))
+    assert data.next()
+
+    for bar in (_bar('13:30', 9.0),  # duplicate of the delivered bar
+                _bar('13:35', 5.0, high=7.0, low=4.0),
+                _bar('13:37', 6.0),
+                _bar('13:36', 3.0, low=2.0),  # out of order
+                None):
+        q.append(bar)
+
+    assert data.next()
+    assert data.datetime.datetime(0) == pd.Timestamp('2024-01-02 13:37')
+    assert (data.open[0], data.high[0], data.low[0], data.close[0]) == \
+        (5.0, 7.0, 2.0, 6.0)
+    assert data.volume[0] == 30
+    assert list(q.dq) == [None]
+
+def test_backlog_keeps_newest_tick(make_data):
+    """Ticks in a backlog are dropped but for the newest one."""
+    data = make_data(timeframe=bt.TimeFrame.Ticks, max_backlog=1)
+    for hhmm, bid in (('13:30', 1.0), ('13:32', 3.0), ('13:31', 2.0)):
+        data.qlive.append(StreamQuote(_ns(hhmm), bid, bid + 0.1, 1))
+
+    assert data.next()
+    assert data.close[0] == 3.0
+    assert not data.qlive
+
+def test_backlog_with_latest_slot(make_data):
+    """A single slot live queue can be caught up too."""
+    q = LatestSlot()
+    data = make_data(qlive=q, live_latest_only=True, max_backlog=0)
+    q.append(_bar('13:31', 2.0))
+    bar = data._drain_backlog(_bar('13:30', 1.0))
+    assert (bar.time, bar.open, bar.close) == (_ns('13:31'), 1.0, 2.0)
+    assert not q
+
+    q.append(None)
+    assert data._drain_backlog(_bar('13:32', 1.0)) == _bar('13:32', 1.0)
+    assert q.get_nowait() is None
+
+def test_live_hist_live_transitions(make_data):
+    """A history block handed over between live bars is delivered in order,
+    then the feed goes back to live without repeating any bar."""
+    data = make_data()
+    data.qlive.append(_bar('13:30', 1.0))
+    assert data.next()
+    assert data._state == AlpacaData._ST_LIVE
+
+    idx = pd.DatetimeIndex(['2024-01-02 13:29', '2024-01-02 13:31',
+                            '2024-01-02 13:32'], tz='UTC')
+    block = pd.DataFrame({'open': 2.0, 'high': 2.0, 'low': 2.0,
+                          'close': [0.0, 2.0, 3.0], 'volume': 1.0},
+                         index=idx)
+    data.qhist = NotifiableDeque()
+    for msg in (block, {}):  # an empty message ends the history
+        data.qhist.append(msg)
+    data._state = AlpacaData._ST_HISTORBACK
+
+    closes = []
+    for _ in range(2):
+        assert data.next()
+        closes.append(data.close[0])
+    assert closes == [2.0, 3.0]
+    assert data._state == AlpacaData._ST_HISTORBACK
+
+    data.qlive.append(_bar('13:32', 9.0))  # already seen in the history
+    data.qlive.append(_bar('13:33', 4.0))
+    assert data.next()
+    assert data._state == AlpacaData._ST_LIVE
+    assert data.datetime.datetime(0) == pd.Timestamp('2024-01-02 13:33')
+    assert data.close[0] == 4.0
+
+def test_live_rejects_duplicate_and_older_bars(make_data):
+    """Live bars not newer than the last delivered one are skipped."""
+    data = make_data()
+    for hhmm, close in (('13:30', 1.0), ('13:30', 2.0), ('13:29', 3.0),
+                        ('13:31', 4.0)):
+        data.qlive.append(_bar(hhmm, close))
+
+    assert data.next()
+    assert data.close[0] == 1.0
+    assert data.next()
+    assert data.close[0] == 4.0
+    assert data.next() is None  # nothing left: timeout
+    assert len(data) == 2
+
+def test_reconnection_backoff_is_bounded(make_data):
+    """Reconnection waits double from the minimum up to the maximum and are
+    reset by the next record."""
+    data = make_data(backfill=False, reconn_backoff_min=0.5,
+                     reconn_backoff_max=4.0, reconn_jitter=0.1)
+    data.qlive.append(_bar('13:30', 1.0))
+    assert data.next()
+
+    for _ in range(6):
+        data.qlive.append(None)
+    data.qlive.append(_bar('13:31', 2.0))
+    assert data.next()
+
+    calls = data.o.streaming_prices.call_args_list[1:]
+    waits = [call.kwargs['tmout'] for call in calls]
+    assert len(waits) == 6
+    assert all(0.5 <= w <= 4.0 for w in waits)
+    assert waits[0] <= 0.6 and waits[-1] == 4.0
+    assert data._reconn_delay == 0.5
@@ -1,155 +1,458 @@
 import pytest
-from datetime import timedelta, time
+from datetime import datetime, timedelta, time, timezone
+import backtrader as bt
 import pandas as pd
 import pytz
 import exchange_calendars
 from unittest.mock import patch, MagicMock
+from alpaca.trading.enums import AssetClass, OrderClass, OrderSide, OrderType, \
+    TimeInForce
 
-from alpaca_backtrader_api.alpacastore import AlpacaStore, Granularity, NY
+import asyncio
+import collections
+import queue
+import random
+import threading
+import time as _time
+import types
+from concurrent.futures import ThreadPoolExecutor
 
-@pytest.fixture
-def store():
-    """Fixture to create a mocked AlpacaStore instance for testing"""
+from alpaca_backtrader_api import alpacastore
+from alpaca_backtrader_api.alpacastore import AlpacaStore, Granularity, NY, NotifiableDeque, LatestSlot, \
+    Streamer, StreamingMethod
+
+_NY_TZ = pytz.timezone(NY)
+
+_CLIENTS = ('trading_client', 'stock_client', 'crypto_client', 'option_client')
+
+@pytest.fixture(scope='module')
+def store_template():
+    """Mocked AlpacaStore built once: the store is a singleton anyway"""
     # We need to patch the __init__ method to avoid actual API client creation
     with patch('alpaca_backtrader_api.alpacastore.AlpacaStore.__init__') as mock_init:
         mock_init.return_value = None  # Don't actually run the real __init__
         store = AlpacaStore()
         
         # Manually set up the required attributes that would normally be set in __init__
-        store.p = MagicMock()
-        store.p.key_id = 'test_key'
-        store.p.secret_key = 'test_secret'
+        store.p = types.SimpleNamespace(key_id='test_key',
+                                        secret_key='test_secret')
         
-        # Mock the clients that would be created in __init__
-        store.trading_client = MagicMock()
-        store.stock_client = MagicMock()
-        store.crypto_client = MagicMock()
-        store.option_client = MagicMock()
+        # Mock the clients that would be created in __init__: the tests set
+        # their return values and check their calls
+        for client in _CLIENTS:
+            setattr(store, client, MagicMock())
         
         return store
 
+@pytest.fixture
+def store(store_template, monkeypatch):
+    """Fixture to hand out the mocked AlpacaStore with fresh mocks and caches"""
+    # the NYSE calendar is cached at module level; tests patch its creation
+    monkeypatch.setattr(alpacastore, '_NYSE_CAL', None)
+    alpacastore._initialize_dates.cache_clear()
+    for client in _CLIENTS:
+        getattr(store_template, client).reset_mock(return_value=True,
+                                                   side_effect=True)
+    store_template._asset_cache = {}
+    store_template._asset_class_cache = {}
+    store_template._filled = {}
+    return store_template
+
+class _ClosedCalendar:
+    """NYSE calendar stand-in, closed at any minute, recording its calls"""
+    def __init__(self, previous_close):
+        self._previous_close = previous_close
+        self.calls = []
+
+    def is_open_on_minute(self, minute):
+        self.calls.append('is_open_on_minute')
+        return False
+
+    def previous_close(self, minute):
+        self.calls.append('previous_close')
+        return self._previous_close
+
 def test_alpaca_broker():
     from alpaca_backtrader_api import alpacabroker
     comminfo = alpacabroker.AlpacaCommInfo(mult=1.0, stocklike=False)
     assert comminfo.getvaluesize(1, 100.00) == 100.00
 
-def test_with_no_dates_specified(store):
-    """Test when no begin or end dates are specified."""
-    # Both dates None
+def test_notifiable_deque():
+    """NotifiableDeque keeps the queue.Queue get/timeout contract."""
+    q = NotifiableDeque()
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+
+    q.append(1)
+    q.append(2)
+    assert len(q) == 2
+    assert q.get(timeout=0.01) == 1
+    assert q.get_nowait() == 2
+    with pytest.raises(queue.Empty):
+        q.get_nowait()
+
+    q.append(3)
+    q.append(4)
+    assert q.drain(timeout=0.01) == [3, 4]
+    assert not q
+
+def test_notifiable_deque_overflow():
+    """A bounded NotifiableDeque drops per policy but keeps control items."""
+    q = NotifiableDeque(maxlen=2)
+    for i in range(4):
+        q.append(i)
+    assert list(q.dq) == [2, 3]
+    assert q.dropped == 2
+
+    q = NotifiableDeque(maxlen=2, overflow='drop_newest')
+    for i in range(4):
+        q.append(i)
+    q.append(None)
+    assert list(q.dq) == [1, None]
+
+def test_notifiable_deque_overflow_keeps_control_messages():
+    """A full NotifiableDeque never evicts a pending None or error."""
+    q = NotifiableDeque(maxlen=2)
+    q.append(None)
+    q.append(1)
+    q.append(2)  # the head is a control message: 2 is dropped instead
+    assert list(q.dq) == [None, 1]
+    q.append({'code': 599})
+    assert list(q.dq) == [None, 1, {'code': 599}]
+    assert q.dropped == 1
+
+def test_latest_slot():
+    """LatestSlot only keeps the newest record but never drops a None."""
+    q = LatestSlot()
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+
+    q.append(1)
+    q.append(2)
+    assert len(q) == 1
+    assert q.get(timeout=0.01) == 2
+
+    q.append(None)
+    q.append(3)
+    assert q.get_nowait() is None
+    assert not q
+
+def test_streamer_routes_bars_per_symbol():
+    """A shared Streamer demultiplexes bars into the queue of each symbol."""
+    instrument = MagicMock(symbol='AAPL', asset_class=AssetClass.US_EQUITY)
+    with patch('alpaca_backtrader_api.alpacastore.StockDataStream') as stream:
+        qa, qm = NotifiableDeque(), NotifiableDeque()
+        streamer = Streamer(qa, instrument=instrument,
+                            method=StreamingMethod.MinuteAgg)
+        streamer.subscribe('MSFT', qm)
+        stream.return_value.subscribe_bars.assert_called_once_with(
+            streamer.on_agg_min, 'MSFT')
+
+    ts = pd.Timestamp('2024-01-02 14:30', tz='UTC')
+    for symbol in ('AAPL', 'MSFT', 'MSFT', 'TSLA'):
+        bar = types.SimpleNamespace(symbol=symbol, timestamp=ts, open=1.0,
+                                    high=2.0, low=0.5, close=1.5, volume=10)
+        asyncio.run(streamer.on_agg_min(bar))
+
+    assert len(qa) == 1
+    assert len(qm) == 2
+    assert qa.get_nowait().time == ts.value
+
+def test_to_ns_matches_pandas():
+    """_to_ns gives the same epoch nanoseconds as pd.Timestamp.value."""
+    for dt in (datetime(2024, 1, 2, 14, 30, 5, 123456, tzinfo=timezone.utc),
+               _NY_TZ.localize(datetime(2024, 7, 3, 9, 30)),
+               datetime(2024, 1, 2, 14, 30),
+               pd.Timestamp('2024-01-02 14:30:00.000000123', tz='UTC')):
+        assert alpacastore._to_ns(dt) == pd.Timestamp(dt).value
+
+def test_get_instrument_is_cached(store):
+    """Asset lookups hit the API once per symbol within the TTL."""
+    store.trading_client.get_asset.return_value = 'asset'
+    assert store.get_instrument('AAPL') == 'asset'
+    assert store.get_instrument('AAPL') == 'asset'
+    assert store.trading_client.get_asset.call_count == 1
+
+    with patch.object(AlpacaStore, '_INSTRUMENT_TTL', 0.0):
+        store.get_instrument('AAPL')
+    assert store.trading_client.get_asset.call_count == 2
+
+def test_prime_asset_cache(store):
+    """Priming resolves each symbol once and skips failed lookups."""
+    store.trading_client.get_asset.side_effect = [
+        types.SimpleNamespace(asset_class=AssetClass.CRYPTO), None]
+    store._prime_asset_cache(['BTC/USD', 'BTC/USD', 'XYZ'])
+    assert store._asset_class_cache == {'BTC/USD': AssetClass.CRYPTO}
+    assert store._asset_class('BTC/USD') == AssetClass.CRYPTO
+    assert store.trading_client.get_asset.call_count == 2
+
+def test_asset_class_of_crypto_pair_skips_api(store):
+    """Crypto pairs are recognized by their shape, without a lookup."""
+    assert store._asset_class('ETH/USD') == AssetClass.CRYPTO
+    store.trading_client.get_asset.assert_not_called()
+
+def test_partial_fill_keeps_order_mapped(store):
+    """Partial fills keep routing until the order is completely filled, and
+    the broker gets the quantity and price of each fill, not the totals."""
+    store.broker = MagicMock()
+    store._ordersrev = {'oid': 1}
+    store._transpend = {}
+    trans = {'id': 'oid', 'side': 'buy'}
+    for status, qty, avg in (('partially_filled', '1', '10.0'),
+                             ('partially_filled', '1', '10.0'),  # repeated
+                             ('filled', '2', '11.0')):
+        store._transaction(dict(trans, status=status, filled_qty=qty,
+                                filled_avg_price=avg))
+        if status != 'filled':
+            assert store._ordersrev == {'oid': 1}
+    assert store._ordersrev == {}
+    assert store._filled == {}
+    fills = [c.args[1:3] for c in store.broker._fill.call_args_list]
+    assert fills == [(1.0, 10.0), (1.0, 12.0)]
+
+def test_deferred_candles_share_one_request(store, monkeypatch, tmp_path):
+    """Deferred downloads for the same period go out as one multi-symbol
+    request, each symbol's bars reach its own queue and are cached."""
+    def get_bars(request):
+        symbols = request['symbol_or_symbols']
+        return types.SimpleNamespace(data={
+            symbol: [types.SimpleNamespace(
+                timestamp=datetime(2024, 1, 2, 5, tzinfo=timezone.utc),
+                open=1.0, high=2.0, low=0.5, close=float(len(symbol)),
+                volume=10.0)]
+            for symbol in symbols})
+
+    fetch = MagicMock(side_effect=get_bars)
+    monkeypatch.setattr(store, 'p', types.SimpleNamespace(
+        bars_cache_dir=str(tmp_path)))
+    monkeypatch.setattr(store, '_bars_dispatch', {
+        AssetClass.US_EQUITY: (fetch, lambda **kwargs: kwargs)},
+        raising=False)
+    monkeypatch.setattr(store, '_pending_candles', [], raising=False)
+    monkeypatch.setattr(store, '_candles_lock', threading.Lock(),
+                        raising=False)
+    store.trading_client.get_asset.return_value = types.SimpleNamespace(
+        asset_class=AssetClass.US_EQUITY)
+
+    for _ in range(2):  # the second round is served from the cache
+        queues = {symbol: store.candles(symbol, datetime(2024, 1, 2),
+                                        datetime(2024, 1, 3),
+                                        bt.TimeFrame.Days, 1, 'bidask', True,
+                                        dataframe=True, defer=True)
+                  for symbol in ('AAPL', 'GOOGL')}
+        store.flush_candles()
+        for symbol, q in queues.items():
+            assert q.get(timeout=5)['close'].tolist() == [len(symbol)]
+            assert q.get(timeout=5) == {}
+
+    fetch.assert_called_once()
+    assert fetch.call_args.args[0]['symbol_or_symbols'] == ['AAPL', 'GOOGL']
+    assert len(list(tmp_path.iterdir())) == 2
+
+@pytest.fixture
+def order_store(store, monkeypatch):
+    """Mocked store set up for the order paths, with a mocked broker"""
+    for name, value in (('p', types.SimpleNamespace(order_workers=2)),
+                        ('broker', MagicMock()),
+                        ('notifs', collections.deque()),
+                        ('_notifs_lock', threading.Lock()),
+                        ('_submit_bucket', None),
+                        ('_orders', {}),
+                        ('_ordersrev', {}),
+                        ('_transpend',
+                         collections.defaultdict(collections.deque))):
+        monkeypatch.setattr(store, name, value, raising=False)
+    return store
+
+def test_order_create_maps_results_to_orders(order_store, monkeypatch):
+    """Orders sent concurrently, over several bursts, are each registered
+    under their own reference and the task ends on the None sentinel."""
+    def submit_order(order_data):
+        _time.sleep(random.uniform(0, 0.01))  # completes out of order
+        if order_data.symbol == 'BAD':
+            raise RuntimeError('rejected')
+        return types.SimpleNamespace(id=f'id-{order_data.symbol}', legs=None)
+
+    order_store.trading_client.submit_order.side_effect = submit_order
+    monkeypatch.setattr(order_store, '_order_executor',
+                        ThreadPoolExecutor(4), raising=False)
+    symbols = [f'S{i}' for i in range(1, 31)]
+    symbols[4] = 'BAD'
+
+    async def run():
+        order_store.q_ordercreate = alpacastore.LoopQueue()
+        for oref, symbol in enumerate(symbols, 1):
+            order_store.q_ordercreate.append(
+                (oref, types.SimpleNamespace(symbol=symbol,
+                                             type=OrderType.LIMIT)))
+        order_store.q_ordercreate.append(None)
+        await asyncio.wait_for(order_store._a_order_create(), 5)
+
+    monkeypatch.setattr(order_store, 'q_ordercreate', None, raising=False)
+    asyncio.run(run())
+    assert order_store.trading_client.submit_order.call_count == 30
+    assert order_store._orders == {oref: f'id-{symbol}'
+                                   for oref, symbol in enumerate(symbols, 1)
+                                   if symbol != 'BAD'}
+    order_store.broker._reject.assert_called_once_with(5)
+    assert [c.args[0] for c in order_store.broker._submit.call_args_list] \
+        == [oref for oref in range(1, 31) if oref != 5]
+
+def test_order_cancel_batches_until_sentinel(order_store, monkeypatch):
+    """Queued cancels are sent once per known order and the thread ends on
+    the None sentinel."""
+    def cancel_order(order_id):
+        if order_id == 'id-4':
+            raise RuntimeError('already filled')
+
+    order_store.trading_client.cancel_order.side_effect = cancel_order
+    order_store._orders.update({1: 'id-1', 2: 'id-2', 4: 'id-4'})
+    monkeypatch.setattr(order_store, 'q_orderclose', NotifiableDeque(),
+                        raising=False)
+    for oref in (1, 2, 2, 3, 4, None):
+        order_store.q_orderclose.append(oref)
+
+    t = threading.Thread(target=order_store._t_order_cancel, daemon=True)
+    t.start()
+    t.join(5)
+    assert not t.is_alive()
+    assert sorted(c.kwargs['order_id'] for c in
+                  order_store.trading_client.cancel_order.call_args_list) \
+        == ['id-1', 'id-2', 'id-4']
+    assert [c.args[0] for c in order_store.broker._cancel.call_args_list] \
+        == [1, 2]
+    assert len(order_store.notifs) == 1
+
+_ORDER_PRICES = {
+    OrderType.MARKET: {},
+    OrderType.LIMIT: {'limit_price': 10.0},
+    OrderType.STOP: {'stop_price': 9.0},
+    OrderType.STOP_LIMIT: {'stop_price': 9.0, 'limit_price': 9.5},
+    OrderType.TRAILING_STOP: {'trail_percent': 1.0},
+}
+
+@pytest.mark.parametrize('bracket', [False, True], ids=['simple', 'bracket'])
+@pytest.mark.parametrize('otype', list(_ORDER_PRICES), ids=lambda t: t.value)
+def test_order_request_builders(store, otype, bracket):
+    """Each order type builds a valid request, with its bracket legs."""
+    okwargs = dict(symbol='AAPL', qty=1, side=OrderSide.BUY,
+                   time_in_force=TimeInForce.DAY, type=otype,
+                   **_ORDER_PRICES[otype])
+    if bracket:
+        okwargs.update(stop_loss={'stop_price': 8.0},
+                       take_profit={'limit_price': 12.0},
+                       order_class=OrderClass.BRACKET)
+
+    request = store._order_request(okwargs)
+    assert request.type == otype
+    for field, price in _ORDER_PRICES[otype].items():
+        assert getattr(request, field) == price
+    if bracket:
+        assert request.order_class == OrderClass.BRACKET
+        assert request.stop_loss.stop_price == 8.0
+        assert request.take_profit.limit_price == 12.0
+    else:
+        assert request.order_class is None
+        assert request.stop_loss is None and request.take_profit is None
+
+def test_token_bucket_paces_after_burst(monkeypatch):
+    """A drained bucket sleeps until the next token is refilled."""
+    clock = types.SimpleNamespace(now=0.0, slept=[])
+    clock.monotonic = lambda: clock.now
+
+    def sleep(secs):
+        clock.slept.append(secs)
+        clock.now += secs
+
+    clock.sleep = sleep
+    monkeypatch.setattr(alpacastore, '_time', clock)
+    bucket = alpacastore.TokenBucket(capacity=2, refill_per_sec=0.5)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == [2.0]
+
+_END = pd.Timestamp('2024-03-15 12:00')
+
+def _check_default_range(begin, end):
+    """End is now and begin 30 days earlier"""
+    now = pd.Timestamp(datetime.now(_NY_TZ))
+    assert (now - end).total_seconds() < 10  # Within 10 seconds
+    assert (end - begin).days == pytest.approx(30, abs=1)
+
+def _check_ordered(begin, end):
+    """Begin was moved back before end"""
+    assert begin <= end
+
+def _check_ten_days(begin, end):
+    """The span of the given dates is kept"""
+    assert (end - begin).total_seconds() == timedelta(days=10).total_seconds()
+
+@pytest.mark.parametrize('begin,end,check', [
+    (None, None, _check_default_range),
+    (_END.tz_localize(_NY_TZ) + pd.Timedelta(days=5),
+     _END.tz_localize(_NY_TZ), _check_ordered),
+    (_END - pd.Timedelta(days=10), _END, _check_ten_days),
+    (_END.tz_localize('UTC') - pd.Timedelta(days=10), _END.tz_localize('UTC'),
+     _check_ten_days),
+], ids=['no_dates', 'begin_after_end', 'naive', 'utc'])
+def test_daily_dates_initialization(store, begin, end, check):
+    """Daily date ranges are filled in, ordered and converted to NY time."""
     result_begin, result_end = store._make_sure_dates_are_initialized_properly(
-        None, None, Granularity.Daily
+        begin, end, Granularity.Daily
     )
-    
-    # Assert results are timezone aware and in NY timezone
+
     assert result_begin.tzinfo.zone == NY
     assert result_end.tzinfo.zone == NY
-    
-    # End should be close to now, begin should be 30 days before end for daily
-    now = pd.Timestamp('now', tz=NY)
-    assert (now - result_end).total_seconds() < 10  # Within 10 seconds
-    assert abs((result_end - result_begin).days - 30) <= 1
+    check(result_begin, result_end)
 
 def test_with_minute_granularity(store):
     """Test with minute granularity which requires market open checks."""
     # Mock calendar to simulate market open checks
-    with patch('exchange_calendars.get_calendar') as mock_calendar:
-        # Setup calendar mock to return market is closed first time, then open
-        mock_cal_instance = MagicMock()
-        mock_cal_instance.is_open_on_minute.side_effect = [False, True]
-        mock_calendar.return_value = mock_cal_instance
-        
+    # market is closed, with a known close
+    calendar = _ClosedCalendar(
+        pd.Timestamp(datetime.now(timezone.utc)).floor('min'))
+    with patch.object(exchange_calendars, 'get_calendar',
+                      return_value=calendar):
         result_begin, result_end = store._make_sure_dates_are_initialized_properly(
             None, None, Granularity.Minute
         )
         
         # For minute granularity, begin should be 3 days before end
-        assert abs((result_end - result_begin).days - 3) <= 1
+        assert (result_end - result_begin).days == pytest.approx(3, abs=1)
         
         # Calendar should have been called to check if market is open
-        mock_cal_instance.is_open_on_minute.assert_called()
-
-def test_with_begin_after_end(store):
-    """Test when begin date is after end date - should adjust begin date."""
-    # Create dates where begin is after end
-    ny_tz = pytz.timezone(NY)
-    end = pd.Timestamp.now(tz=ny_tz)
-    begin = end + pd.Timedelta(days=5)
-    
-    result_begin, result_end = store._make_sure_dates_are_initialized_properly(
-        begin, end, Granularity.Daily
-    )
-    
-    # Result begin should be adjusted to be before end
-    assert result_begin <= result_end
-
-def test_timezone_conversion(store):
-    """Test that naive datetime objects are properly converted to timezone-aware."""
-    # Create naive timestamp objects
-    naive_end = pd.Timestamp.now()
-    naive_begin = naive_end - pd.Timedelta(days=10)
-    
-    result_begin, result_end = store._make_sure_dates_are_initialized_properly(
-        naive_begin, naive_end, Granularity.Daily
-    )
-    
-    # Results should be timezone aware
-    assert result_begin.tzinfo is not None
-    assert result_end.tzinfo is not None
-    assert result_begin.tzinfo.zone == NY
-    assert result_end.tzinfo.zone == NY
-
-def test_already_timezone_aware(store):
-    """Test with already timezone-aware datetime objects."""
-    # Create timezone-aware timestamp objects in UTC
-    utc_end = pd.Timestamp.now(tz='UTC')
-    utc_begin = utc_end - pd.Timedelta(days=10)
-    
-    result_begin, result_end = store._make_sure_dates_are_initialized_properly(
-        utc_begin, utc_end, Granularity.Daily
-    )
-    
-    # Results should be converted to NY timezone
-    assert result_begin.tzinfo.zone == NY
-    assert result_end.tzinfo.zone == NY
-    
-    # Time difference should remain approximately the same
-    original_diff = (utc_end - utc_begin).total_seconds()
-    result_diff = (result_end - result_begin).total_seconds()
-    assert abs(original_diff - result_diff) <= 10  # Allow small variation due to DST changes
+        assert 'is_open_on_minute' in calendar.calls
 
 def test_market_hours_adjustment(store):
     """Test that out-of-market-hours are properly adjusted for minute granularity."""
     # Use fixed dates to make test deterministic
     # Create a date with after-hours timestamp (20:00 ET)
-    ny_tz = pytz.timezone(NY)
-    today = pd.Timestamp.now(tz=ny_tz).replace(hour=20, minute=0, second=0, microsecond=0)
+    today = pd.Timestamp(datetime.now(_NY_TZ)).replace(hour=20, minute=0, second=0, microsecond=0)
     
     # If today is weekend, move to Friday
     weekday = today.dayofweek
     if weekday >= 5:  # 5=Saturday, 6=Sunday
         today = today - pd.Timedelta(days=(weekday - 4))  # Move to Friday
     
-    # Expected result should be the previous day's market close (15:59)
-    expected_date = today.date() - pd.Timedelta(days=1)
+    # Expected result should be the last minute of the day's session (15:59)
+    expected_date = today.date()
     
-    # Mock the calendar to simulate market closed at 20:00 but open at 16:00 (market close time)
-    with patch('exchange_calendars.get_calendar') as mock_calendar:
-        # Calendar will say market is closed first time, then open
-        mock_cal_instance = MagicMock()
-        
-        # First call (for original time 20:00) returns False (market closed)
-        # Second call (for adjusted time 15:59 previous day) returns True (market open)
-        mock_cal_instance.is_open_on_minute.side_effect = [False, True]
-        mock_calendar.return_value = mock_cal_instance
-        
+    # Mock the calendar to simulate market closed at 20:00 after closing at 16:00
+    # 20:00 is out of market hours; the previous close is 16:00 that day
+    calendar = _ClosedCalendar(today.replace(hour=16).tz_convert('UTC'))
+    with patch.object(exchange_calendars, 'get_calendar',
+                      return_value=calendar):
         result_begin, result_end = store._make_sure_dates_are_initialized_properly(
             None, today, Granularity.Minute
         )
         
-        # For minute data with after hours date, it should adjust to 15:59 of the PREVIOUS day
+        # For minute data with after hours date, it should adjust to 15:59 of the same session
         assert result_end.hour == 15
         assert result_end.minute == 59
         assert result_end.date() == expected_date
         
-        # Check calendar was properly called
-        assert mock_cal_instance.is_open_on_minute.call_count == 2 
\ No newline at end of file
+        # Check calendar was properly called, without scanning day by day,
+        # and that an explicit range is worked out only once
+        assert store._make_sure_dates_are_initialized_properly(
+            None, today, Granularity.Minute) == (result_begin, result_end)
+        assert calendar.calls == ['is_open_on_minute', 'previous_close'] 
\ No newline at end of file